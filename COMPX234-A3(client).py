@@ -1,51 +1,256 @@
 import socket
 import sys
 import os
+import select
+import threading
+import time
+from collections import deque
+
+from common import parse_options
+from tuple_protocol import HELLO, SINGLE_OPCODES, BinaryFramer, MessageFramer
+from tuple_protocol import decode_binary_response, encode_binary_request, encode_request, format_response
+
+# Option defaults for the client, each one can be overridden with --name value on the command line
+DEFAULT_OPTIONS = {
+    'window': 1,  # Number of messages that may be waiting for a response at the same time
+    'binary': False,  # Use the binary protocol, which has no message size limit
+    'batch': 1,  # With --binary, send up to this many consecutive lines with the same command as one MREAD/MGET/MPUT
+    'load': False,  # Replay every file at once as a load test and report throughput and latency instead of responses
+    'connections': 4,  # Load test connections, connection i replays file i, i + N, ... (or file i % files)
+    'rate': 0.0,  # Load test target requests per second over all connections, 0 for as fast as possible
+    'repeat': 1,  # Number of times every load test connection replays its files
+}
+
+
+# Read the request file and return (line, command, key, value) for every valid line
+def read_requests(request_file, size_limit=True):
+    requests = []
+    with open(request_file, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            parts = line.split(' ')
+            command = parts[0]
+            # Only R, G and P with a key exist, the binary protocol has no way to send anything else
+            if command not in SINGLE_OPCODES or len(parts) < 2:
+                print(f"Error: Invalid request {line}")
+                continue
+            key = parts[1]
+            value = parts[2] if len(parts) == 3 else ''
+            # Check the length of the request string, the binary protocol has no such limit
+            if size_limit and len(key + ' ' + value) > 970:
+                print(f"Error: Request size exceeds limit for {line}")
+                continue
+            requests.append((line, command, key, value))
+    return requests
+
+
+# Group the requests into messages, returning (message bytes, requests it carries) for each one
+def build_messages(requests, binary=False, batch=1):
+    messages = []
+    if not binary:
+        for request in requests:
+            _, command, key, value = request
+            messages.append((encode_request(command, key, value), [request]))
+        return messages
+    group = []
+    for request in requests + [None]:
+        # A group ends when the command changes, when it is full, or at the end of the file
+        if group and (request is None or request[1] != group[0][1] or len(group) >= batch):
+            items = [(key, value) for _, _, key, value in group]
+            messages.append((encode_binary_request(group[0][1], items), group))
+            group = []
+        if request is not None:
+            group.append(request)
+    return messages
+
+
+# Turn one response into the text printed for each request it answers
+def response_lines(response, requests, binary):
+    if not binary:
+        return [f"{requests[0][0]}: {response.decode('utf-8')}"]
+    return [f"{line}: {format_response(command, key, status, value)}"
+            for (line, command, key, _), (status, value) in zip(requests, decode_binary_response(response))]
+
+
 # Functions that handle client requests
-def process_requests(server_host, server_port, request_file):
+def process_requests(server_host, server_port, request_file, window=1, binary=False, batch=1):
     # Create a TCP socket
     client_socket = socket.socket(socket.AF_INET, socket. SOCK_STREAM)
     try:
         # Connect to the server
         client_socket.connect((server_host, server_port))
-        with open(request_file, 'r') as file:
-          
-            for line in file:
-                line = line.strip()
-                if not line:
-                    continue
-                parts = line.split(' ')
-                command = parts[0]
-                key = parts[1]
-                value = parts[2] if len(parts) == 3 else ''
-                # Check the length of the request string
-                if len(key + ' ' + value) > 970:
-                    print(f"Error: Request size exceeds limit for {line}")
-                    continue
-                # Build the request message
-                msg = f"{str(len(line) + 3).zfill(3)}{command} {key}"
-                if command == 'P':
-                    msg += f" {value}"
-                # Send a request message
-                client_socket.send(msg.encode('utf-8'))
-                # Receive a server response
-                response = client_socket.recv(1024).decode('utf-8')
-                print(f"{line}: {response}")
+        messages = build_messages(read_requests(request_file, not binary), binary, batch)
+
+        # Keep up to window messages in flight; the server answers in order, so responses match the oldest pending message
+        framer = BinaryFramer(hello=True) if binary else MessageFramer()
+        pending = deque()
+        next_message = 0
+        # Bytes of the window's messages that have not been sent yet. The socket is non-blocking and select()
+        # waits until it can send or has responses to read, so responses are read while a large window is still
+        # being sent. Otherwise the server stops reading once nobody reads its responses and both sides block.
+        unsent = bytearray(HELLO if binary else b'')  # With --binary, HELLO asks for the binary protocol
+        client_socket.setblocking(False)
+        while next_message < len(messages) or pending:
+            while next_message < len(messages) and len(pending) < window:
+                msg, requests = messages[next_message]
+                unsent += msg
+                pending.append(requests)
+                next_message += 1
+
+            readable, writable, _ = select.select([client_socket], [client_socket] if unsent else [], [])
+            if writable:
+                try:
+                    del unsent[:client_socket.send(unsent)]
+                except BlockingIOError:
+                    pass
+            if not readable:
+                continue
+            # Receive server responses, a read may hold part of a response or several of them
+            try:
+                data = client_socket.recv(65536)
+            except BlockingIOError:
+                continue
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            framer.feed(data)
+            for response in framer.messages():
+                for line in response_lines(response, pending.popleft(), binary):
+                    print(line)
     except Exception as e:
         print(f"Error: {e}")
     finally:
         client_socket.close()
 
 
+# Replay messages over one connection with up to window in flight and add (command, latency) pairs to results.
+# With a rate the messages are sent on a fixed schedule and latency is measured from the scheduled send time,
+# so a slow server cannot hide its queueing delay by holding the client back. Raises the error that ended the
+# connection early, if any.
+def run_load_connection(server_host, server_port, messages, window, rate, binary, results):
+    client_socket = socket.create_connection((server_host, server_port))
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if binary:
+        client_socket.sendall(HELLO)
+    pending = deque()
+    slots = threading.Semaphore(window)
+    latencies = []
+    errors = []
+
+    def receive():
+        framer = BinaryFramer(hello=True) if binary else MessageFramer()
+        received = 0
+        try:
+            while received < len(messages):
+                data = client_socket.recv(65536)
+                if not data:
+                    raise ConnectionError("Server closed the connection")
+                framer.feed(data)
+                now = time.perf_counter()
+                for _ in framer.messages():
+                    command, start = pending.popleft()
+                    latencies.append((command, now - start))
+                    slots.release()
+                    received += 1
+        except Exception as e:
+            errors.append(e)
+            slots.release()  # Wake the sender if it waits for a slot that no response will free
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+    interval = 1 / rate if rate > 0 else 0
+    next_time = time.perf_counter()
+    try:
+        for msg, requests in messages:
+            slots.acquire()
+            if errors:
+                break
+            if interval:
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                start = next_time
+                next_time += interval
+            else:
+                start = time.perf_counter()
+            pending.append((requests[0][1], start))
+            client_socket.sendall(msg)
+        receiver.join()
+    finally:
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR)  # Wakes the receiver if sending failed first
+        except OSError:
+            pass
+        client_socket.close()
+        results.extend(latencies)
+    if errors:
+        raise errors[0]
+
+
+# Return the latency below which the given fraction of the sorted latencies fall
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+
+# Replay all request files at once over several connections and print throughput and latency per command
+def run_load(server_host, server_port, txt_files, options):
+    binary = options['binary']
+    file_messages = [build_messages(read_requests(txt_file, not binary), binary, max(1, options['batch']))
+                     for txt_file in txt_files]
+    connections = max(1, options['connections'])
+    # Every connection replays its own files in order, so a file's P/G/R sequence keeps its meaning
+    plans = []
+    for index in range(connections):
+        assigned = file_messages[index::connections] or [file_messages[index % len(file_messages)]]
+        plans.append([message for _ in range(options['repeat']) for messages in assigned for message in messages])
+
+    results = []
+    failures = []
+
+    def connection(plan):
+        try:
+            run_load_connection(server_host, server_port, plan, max(1, options['window']),
+                                options['rate'] / connections, binary, results)
+        except Exception as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=connection, args=(plan,)) for plan in plans]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if failures:
+        print(f"Error: {failures[0]} ({len(failures)} of {connections} connections failed)")
+        return
+
+    requests = sum(len(message[1]) for plan in plans for message in plan)
+    print(f"{requests} requests in {len(results)} messages over {connections} connections in {elapsed:.2f}s: "
+          f"{requests / elapsed:.0f} requests/s")
+    print(f"{'command':>7} {'messages':>9} {'p50 ms':>8} {'p99 ms':>8} {'p999 ms':>8} {'max ms':>8}")
+    for command in sorted({command for command, _ in results}):
+        latencies = sorted(latency * 1000 for name, latency in results if name == command)
+        print(f"{command:>7} {len(latencies):>9} {percentile(latencies, 0.5):>8.3f} {percentile(latencies, 0.99):>8.3f} "
+              f"{percentile(latencies, 0.999):>8.3f} {latencies[-1]:>8.3f}")
+
+
 # Main function, start the client
 def main():
     # Check the command line arguments, now all you need is the server host, port, and directory path
-    if len(sys.argv) != 4:
-        print("Usage: python client.py <server_host> <server_port> <directory_path>")
+    if len(sys.argv) < 4:
+        print("Usage: python client.py <server_host> <server_port> <directory_path> [--window N] [--binary] [--batch N]\n"
+              "                        [--load] [--connections N] [--rate REQUESTS_PER_SECOND] [--repeat N]")
         return
     server_host = sys.argv[1]
     server_port = int(sys.argv[2])
     directory_path = sys.argv[3]
+    try:
+        options = parse_options(sys.argv[4:], DEFAULT_OPTIONS)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
 
     # Check if the directory exists
     if not os.path.isdir(directory_path):
@@ -55,14 +260,19 @@ def main():
     # Get all .txt files in the directory
     txt_files = [os.path.join(directory_path, f) for f in os.listdir(directory_path) if f.endswith('.txt')]
 
+    if options['load']:
+        if not txt_files:
+            print(f"Error: No .txt files in {directory_path}")
+            return
+        run_load(server_host, server_port, txt_files, options)
+        return
+
     # Process each .txt file
     for txt_file in txt_files:
         print(f"Processing file: {txt_file}")
-        process_requests(server_host, server_port, txt_file)
+        process_requests(server_host, server_port, txt_file, max(1, options['window']),
+                         options['binary'], max(1, options['batch']))
 
 
 if __name__ == "__main__":
     main()
-
-
-
@@ -1,78 +1,437 @@
+import asyncio
+import logging
+import multiprocessing
+import os
 import socket
+import sys
 import threading
 import time
+import zlib
+from collections import deque
+
+from common import HISTOGRAM_BUCKETS, bucket_range, histogram_percentile, parse_options
+from metrics import METRICS_OPTIONS, Metrics, setup_logging
+from tuple_protocol import HELLO, SINGLE_OPCODES, STATUS_EXISTS, STATUS_INVALID, STATUS_MISSING, STATUS_OK
+from tuple_protocol import BinaryFramer, ServerFramer
+from tuple_protocol import decode_binary_request, decode_binary_response, encode_binary_request, encode_binary_response
+from tuple_protocol import encode_response, format_response
+from tuple_space import CLIENTS, COUNTER_NAMES, ERRORS, GETS, OPERATIONS, PUTS, READS
+from tuple_space import CompactTupleStore, OperationStats, ShardedTupleSpace
+from tuple_wal import WriteAheadLog
+
+# Option defaults for the server, each one can be overridden with --name value on the command line
+DEFAULT_OPTIONS = {
+    'mode': 'thread',  # thread: one thread per client, async: single-process asyncio event loop
+    'backlog': socket.SOMAXCONN,  # Length of the accept queue passed to listen()
+    'shards': 64,  # Number of independently locked shards in the tuple space
+    'storage': 'dict',  # dict: Python dict per shard, compact: UTF-8 arena per shard, slower but far smaller
+    'workers': 1,  # Number of worker processes sharing the port with SO_REUSEPORT, each runs an event loop
+    'wal': '',  # Directory of the write-ahead log and snapshots, empty to keep the tuple space in memory only
+    'snapshot-every': 1000000,  # Log records after which the log is compacted into a snapshot
+    **METRICS_OPTIONS,
+}
+
+log = logging.getLogger('tuple_server')
+
+# Request latency per command, bytes moved and open connections of this process, see metrics.py
+metrics = Metrics()
+
+# Write-ahead log of this process, None when persistence is off
+wal = None
+
+# Set in worker processes only: the partition this worker owns and a link to every other worker
+partition_index = 0
+peer_links = None
+
+# Number of values each worker publishes for the combined summary: tuple count, key size, value size,
+# the size histogram and the operation counters
+SUMMARY_FIELDS = 3 + HISTOGRAM_BUCKETS + len(COUNTER_NAMES)
+
+
+# Split one complete request message into its command, key and value
+def parse_request(data):
+    msg_size = int(data[:3]) #msg_size: The total length of the message, parsed from the first 3 characters of the message.
+    command = data[3] #command: The operation command, obtained from the 4th character of the message. It can be R (read), G (get and remove), or P (put).
+    # The client sends "NNNC key" or "NNNP key value", so the key starts after the space that follows the command.
+    key = data[5:msg_size] if command != 'P' else data[5:msg_size].rsplit(' ', 1)[0]
+    #key: The key. Different truncations are made according to different commands.
+    value = data[5:msg_size].split(' ')[-1] if command == 'P' else ''
+    #value: The value, which only exists when the command is P.
+    return command, key, value
+
+
+# Carry out one parsed request on the local tuple space and return its (status, value) result
+def execute_request(command, key, value):
+    stats.add(OPERATIONS) #One more operation has been processed, counted in this thread's own counters.
+    if command == 'R':#R: Read operation. If the key exists, return the corresponding value; otherwise, return an error.
+        stats.add(READS)
+        value = tuple_space.read(key)
+        if value is not None:
+            return STATUS_OK, value
+        stats.add(ERRORS)
+        return STATUS_MISSING, None
+    elif command == 'G':#G: Get and remove operation. If the key exists, remove the key - value pair and return the removed value; otherwise, return an error.
+        stats.add(GETS)
+        value = tuple_space.get(key) #The check and the removal are one atomic step on the key's shard.
+        if value is not None:
+            return STATUS_OK, value
+        stats.add(ERRORS)
+        return STATUS_MISSING, None
+    elif command == 'P':#P: Put operation. If the key already exists, return an error; otherwise, put the key - value pair into the tuple space.
+        stats.add(PUTS)
+        if tuple_space.put(key, value):
+            return STATUS_OK, value
+        stats.add(ERRORS)
+        return STATUS_EXISTS, None
+    stats.add(ERRORS)
+    return STATUS_INVALID, None
+
+
+# Carry out one request like execute_request and record how long it took under its command
+def run_request(command, key, value):
+    started = time.perf_counter()
+    result = execute_request(command, key, value)
+    metrics.observe(command, time.perf_counter() - started)
+    return result
+
+
+# Create the tuple space with the shard count and storage backend chosen on the command line
+def create_tuple_space(options):
+    store_factory = CompactTupleStore if options['storage'] == 'compact' else dict
+    return ShardedTupleSpace(max(1, options['shards']), store_factory)
+
+
+# Return the worker partition that owns a key. crc32 gives every process the same answer, unlike hash().
+def key_partition(key, partitions):
+    return zlib.crc32(key.encode('utf-8')) % partitions
+
+
+# Carry out a list of (command, key, value) requests and return their results in order.
+# In a worker, requests for keys owned by other workers are sent to their owners at once and a coroutine
+# that waits for their answers is returned instead.
+def dispatch(requests):
+    if not peer_links:
+        return [run_request(*request) for request in requests]
+    results = [None] * len(requests)
+    remote = {}
+    for position, request in enumerate(requests):
+        owner = key_partition(request[1], len(peer_links))
+        if owner == partition_index or request[0] not in SINGLE_OPCODES: #Unknown commands are rejected locally.
+            results[position] = run_request(*request)
+        else:
+            remote.setdefault(owner, []).append(position)
+    if not remote:
+        return results
+    # One binary frame per owner carries all of that owner's keys, in request order
+    forwarded = []
+    for owner, positions in remote.items():
+        command = requests[positions[0]][0]
+        frame = encode_binary_request(command, [(requests[position][1], requests[position][2]) for position in positions])
+        forwarded.append((positions, peer_links[owner].send(frame)))
+    return collect_forwarded(results, forwarded)
+
+
+# Fill in the results of forwarded requests once their owners have answered
+async def collect_forwarded(results, forwarded):
+    for positions, future in forwarded:
+        for position, result in zip(positions, decode_binary_response(await future)):
+            results[position] = result
+    return results
+
+
+# Split one message into its requests, in whichever protocol the connection uses
+def decode_message(message, binary):
+    if binary:
+        return decode_binary_request(message)
+    return [parse_request(message.decode('utf-8'))]
+
+
+# Encode the response to one message from the results of its requests
+def encode_results(requests, results, binary):
+    if binary:
+        return encode_binary_response(results)
+    command, key, _ = requests[0]
+    status, value = results[0]
+    try:
+        return encode_response(format_response(command, key, status, value))
+    except ValueError:
+        # A value stored through the binary protocol can be too long for a text response
+        return encode_response(f"ERR {key} is too large for the text protocol")
+
+
 # Functions that handle client requests
 def handle_client(client_socket, client_address):
-    global tuple_space, total_clients, total_operations, total_reads, total_gets, total_puts, total_errors
-    total_clients += 1
+    stats.add(CLIENTS)
+    metrics.add_gauge('connections', 1)
 
+    framer = ServerFramer() #The first byte the client sends picks the text or the binary protocol.
     try:
         while True:
-           #Use client_socket.recv(1024) to receive the message sent by the client, with a maximum reception of 1024 bytes.
-            data = client_socket.recv(1024).decode('utf-8') #decode('utf-8') decodes the received byte data into a string.
+            #recv() can return part of a message or several pipelined messages, so the framer splits the stream by the message sizes.
+            data = client_socket.recv(65536)
             if not data:
                 break #If no data is received, break out of the loop.
-      
-            msg_size = int(data[:3]) #msg_size: The total length of the message, parsed from the first 3 characters of the message.
-            command = data[3] #command: The operation command, obtained from the 4th character of the message. It can be R (read), G (get and remove), or P (put).
-            key = data[4:msg_size - 1] if command != 'P' else data[4:msg_size - len(data.split(' ')[-1]) - 2]
-            #key: The key. Different truncations are made according to different commands.
-            value = data.split(' ')[-1] if command == 'P' else ''
-            #value: The value, which only exists when the command is P.
-            response = ''
-            total_operations += 1 #total_operations is incremented by 1, indicating that one operation has been processed.
-            if command == 'R':#R: Read operation. If the key exists, return the corresponding value; otherwise, return an error message.
-                total_reads += 1
-                if key in tuple_space:
-                    response = f"{msg_size} OK ({key}, {tuple_space[key]}) read"
-                else:
-                    total_errors += 1
-                    response = f"{msg_size} ERR {key} does not exist"
-            elif command == 'G':#G: Get and remove operation. If the key exists, remove the key - value pair and return the removed value; otherwise, return an error message.
-                total_gets += 1
-                if key in tuple_space:
-                    value = tuple_space.pop(key)
-                    response = f"{msg_size} OK ({key}, {value}) removed"
-                else:
-                    total_errors += 1
-                    response = f"{msg_size} ERR {key} does not exist"
-            elif command == 'P':#P: Put operation. If the key already exists, return an error message; otherwise, put the key - value pair into the tuple space.
-                total_puts += 1
-                if key in tuple_space:
-                    total_errors += 1
-                    response = f"{msg_size} ERR {key} already exists"
-                else:
-                    tuple_space[key] = value
-                    response = f"{msg_size} OK ({key}, {value}) added"
-
-            client_socket.send(response.encode('utf-8')) #Encode the response message into byte data and send it to the client.
+            metrics.count('bytes_received', len(data))
+            framer.feed(data)
+
+            # Answer every complete message from this read with a single send
+            responses = [framer.take_greeting()]
+            for message in framer.messages():
+                requests = decode_message(message, framer.binary)
+                responses.append(encode_results(requests, dispatch(requests), framer.binary))
+            if len(responses) > 1 or responses[0]:
+                if wal:
+                    wal.sync().result() #Only answer once this thread's changes are on disk, sharing the fsync with other threads.
+                response = b''.join(responses)
+                client_socket.sendall(response) #sendall keeps sending until every response byte has gone out.
+                metrics.count('bytes_sent', len(response))
     except Exception as e:
-        total_errors += 1
-        print(f"Error handling client {client_address}: {e}") 
-      #If an exception occurs while handling the client request, total_errors is incremented by 1, and an error message is printed.
+        stats.add(ERRORS)
+        log.error("Error handling client %s: %s", client_address, e)
+      #If an exception occurs while handling the client request, the error count is incremented by 1, and an error message is printed.
     finally:
         client_socket.close()
+        stats.retire() #Fold this thread's counters into the totals before the thread exits.
+        metrics.add_gauge('connections', -1)
+        metrics.retire()
       #Whether an exception occurs or not, finally close the socket connection with the client
 
+
+# Coroutine that handles one client connection in async mode
+async def handle_client_async(reader, writer):
+    stats.add(CLIENTS)
+    metrics.add_gauge('connections', 1)
+    try:
+        await serve_connection(reader, writer)
+    finally:
+        metrics.add_gauge('connections', -1)
+
+
+# Coroutine that handles requests forwarded by another worker, which are always for keys this worker owns
+async def handle_peer_async(reader, writer):
+    await serve_connection(reader, writer)
+
+
+# Read framed requests from one connection until it closes and write back the responses in order
+async def serve_connection(reader, writer):
+    client_address = writer.get_extra_info('peername')
+    framer = ServerFramer()
+    try:
+        while True:
+            # An idle connection only costs its transport and stream buffers instead of a whole thread stack.
+            data = await reader.read(65536)
+            if not data:
+                break #The client closed the connection.
+            metrics.count('bytes_received', len(data))
+            framer.feed(data)
+
+            pending = [(requests, dispatch(requests)) for requests in
+                       (decode_message(message, framer.binary) for message in framer.messages())]
+            greeting = framer.take_greeting()
+            if pending or greeting:
+                responses = [greeting]
+                for requests, results in pending:
+                    # Forwarded requests are already on their way to the owners, wait for their answers in request order
+                    if not isinstance(results, list):
+                        results = await results
+                    responses.append(encode_results(requests, results, framer.binary))
+                if wal:
+                    await asyncio.wrap_future(wal.sync())
+                response = b''.join(responses)
+                writer.write(response)
+                metrics.count('bytes_sent', len(response))
+                await writer.drain()
+    except Exception as e:
+        stats.add(ERRORS)
+        log.error("Error handling client %s: %s", client_address, e)
+    finally:
+        writer.close()
+
+
+# Pipelined binary protocol connection from one worker to another. The owner answers in request order,
+# so each response completes the oldest pending future.
+class PeerLink:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = deque()
+        self.task = asyncio.ensure_future(self.read_responses())
+
+    @classmethod
+    async def connect(cls, port):
+        reader, writer = await asyncio.open_connection('localhost', port)
+        writer.write(HELLO)
+        return cls(reader, writer)
+
+    def send(self, frame):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(future)
+        self.writer.write(frame)
+        return future
+
+    async def read_responses(self):
+        framer = BinaryFramer(hello=True)
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                break
+            framer.feed(data)
+            for payload in framer.messages():
+                self.pending.popleft().set_result(payload)
+        while self.pending:
+            self.pending.popleft().set_exception(ConnectionError("Worker link closed"))
+
+
+# Open the write-ahead log in a directory, replay it into the tuple space and start logging
+def open_wal(directory, options):
+    global wal
+    wal = WriteAheadLog(directory, tuple_space, max(1, options['snapshot-every']))
+    start = time.perf_counter()
+    records = wal.recover()
+    print(f"Recovered {len(tuple_space)} tuples from {records} log records in {time.perf_counter() - start:.2f}s")
+    wal.start()
+
+
+# Raise the open file limit so the event loop can hold many idle connections at once
+def raise_file_limit():
+    try:
+        import resource
+    except ImportError:
+        return #The resource module is not available on Windows.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+# Run the server on a single asyncio event loop
+async def serve_async(port, backlog):
+    server = await asyncio.start_server(handle_client_async, 'localhost', port, backlog=backlog, reuse_address=True)
+    async with server:
+        await server.serve_forever()
+
+
+# Run one worker process: serve the shared client port and the internal port used by the other workers
+async def serve_worker(index, port, backlog, peer_ports, barrier):
+    global peer_links
+    peer_server = await asyncio.start_server(handle_peer_async, 'localhost', 0)
+    peer_ports[index] = peer_server.sockets[0].getsockname()[1]
+    # Wait until every worker has published its internal port, without blocking the event loop
+    await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+    peer_links = [None if i == index else await PeerLink.connect(peer_ports[i]) for i in range(len(peer_ports))]
+
+    # Every worker binds its own listening socket to the same port, the kernel spreads new connections between them
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    listen_socket.bind(('localhost', port))
+    server = await asyncio.start_server(handle_client_async, sock=listen_socket, backlog=backlog)
+    async with peer_server, server:
+        await server.serve_forever()
+
+
+# Entry point of a worker process
+def run_worker(index, port, options, peer_ports, barrier, shared_summary):
+    global tuple_space, stats, metrics, partition_index
+    tuple_space = create_tuple_space(options)
+    stats = OperationStats()
+    metrics = Metrics()
+    partition_index = index
+    setup_logging(options['log-level'])
+    metrics.start_exports(options, index)
+    raise_file_limit()
+    if options['wal']:
+        open_wal(os.path.join(options['wal'], f"worker-{index}"), options)
+
+    publish_thread = threading.Thread(target=publish_summary, args=(index, shared_summary))
+    publish_thread.daemon = True
+    publish_thread.start()
+    try:
+        asyncio.run(serve_worker(index, port, options['backlog'], peer_ports, barrier))
+    except KeyboardInterrupt:
+        pass
+
+
+# Copy this worker's summary figures into its slot of the shared array once a second
+def publish_summary(index, shared_summary):
+    start = index * SUMMARY_FIELDS
+    while True:
+        tuple_count, total_key_size, total_value_size, histogram, totals = local_summary()
+        values = [tuple_count, total_key_size, total_value_size] + histogram + [totals[name] for name in COUNTER_NAMES]
+        with shared_summary.get_lock():
+            shared_summary[start:start + SUMMARY_FIELDS] = values
+        time.sleep(1)
+
+
+# Collect the tuple space figures and operation counters of this process
+def local_summary():
+    return tuple_space.summary() + (stats.snapshot(),)
+
+
+# Add up the figures published by every worker. Each key lives in exactly one partition, so the sums are exact.
+def combined_summary(shared_summary, workers):
+    with shared_summary.get_lock():
+        values = shared_summary[:]
+    sums = [sum(values[worker * SUMMARY_FIELDS + field] for worker in range(workers)) for field in range(SUMMARY_FIELDS)]
+    counters = sums[3 + HISTOGRAM_BUCKETS:]
+    return sums[0], sums[1], sums[2], sums[3:3 + HISTOGRAM_BUCKETS], dict(zip(COUNTER_NAMES, counters))
+
+
+# Record how many partitions a log directory was written with, and return False if that differs from workers
+def check_partitions(directory, workers):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'partitions')
+    if os.path.exists(path):
+        with open(path, 'r') as file:
+            return int(file.read()) == workers
+    with open(path, 'w') as file:
+        file.write(str(workers))
+    return True
+
+
+# Start the worker processes and print their combined summary
+def start_workers(port, options):
+    workers = options['workers']
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print("Worker processes need SO_REUSEPORT, which this platform does not support")
+        return
+    if options['wal'] and not check_partitions(options['wal'], workers):
+        print("The log directory was written by a different number of workers, keys would land in the wrong partition")
+        return
+    peer_ports = multiprocessing.Array('i', workers)
+    barrier = multiprocessing.Barrier(workers)
+    shared_summary = multiprocessing.Array('q', workers * SUMMARY_FIELDS)
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(index, port, options, peer_ports, barrier, shared_summary), daemon=True)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    print(f"Server is running on port {port} with {workers} worker processes, waiting for clients...")
+    try:
+        print_tuple_space_summary(lambda: combined_summary(shared_summary, workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+
+
 # A function that prints tuple space information periodically
- def print_tuple_space_summary():
-    global tuple_space, total_clients, total_operations, total_reads, total_gets, total_puts, total_errors
+def print_tuple_space_summary(collect=local_summary):
     while True:
-        time.sleep(10) 
+        time.sleep(10)
         #Pausing the program for 10 seconds means that subsequent statistics and printing operations are performed every 10 seconds.
-        tuple_count = len(tuple_space)
-       # Gets the number of key-value pairs in the tuple space.
+        tuple_count, total_key_size, total_value_size, histogram, totals = collect()
+       # Gets the number of key-value pairs, their running size totals and the operation counters, without walking the tuples.
         if tuple_count == 0:
             avg_tuple_size = 0
             avg_key_size = 0
             avg_value_size = 0
         else:
-            total_tuple_size = sum(len(key) + len(value) for key, value in tuple_space.items())
-            #The sum function and generator expressions calculate the total length of all key-value pairs
-            total_key_size = sum(len(key) for key in tuple_space.keys())
-            #Calculate the total length of all keys
-            total_value_size = sum(len(value) for value in tuple_space.values())
-            #Calculate the total length of all value
+            total_tuple_size = total_key_size + total_value_size
             avg_tuple_size = total_tuple_size / tuple_count
             avg_key_size = total_key_size / tuple_count
             avg_value_size = total_value_size / tuple_count
@@ -83,55 +442,94 @@ def handle_client(client_socket, client_address):
         print(f"Average tuple size: {avg_tuple_size}")
         print(f"Average key size: {avg_key_size}")
         print(f"Average value size: {avg_value_size}")
-        print(f"Total clients: {total_clients}")
-        print(f"Total operations: {total_operations}")
-        print(f"Total READs: {total_reads}")
-        print(f"Total GETs: {total_gets}")
-        print(f"Total PUTs: {total_puts}")
-        print(f"Total errors: {total_errors}")
+        # Percentiles come from the size histogram, so each one is the upper bound of a power of two bucket
+        print(f"Tuple size p50/p90/p99: {histogram_percentile(histogram, 0.5)}/"
+              f"{histogram_percentile(histogram, 0.9)}/{histogram_percentile(histogram, 0.99)}")
+        print("Tuple size histogram: " + ", ".join(
+            f"{low}-{high}: {tuples}" for low, high, tuples in
+            ((*bucket_range(bucket), tuples) for bucket, tuples in enumerate(histogram)) if tuples))
+        print(f"Total clients: {totals['clients']}")
+        print(f"Total operations: {totals['operations']}")
+        print(f"Total READs: {totals['reads']}")
+        print(f"Total GETs: {totals['gets']}")
+        print(f"Total PUTs: {totals['puts']}")
+        print(f"Total errors: {totals['errors']}")
         #The f-string is used to format the statistics of the output tuple space, which is convenient to view the status and operation of the tuple space
-   # Main function, start the server     
+
+
+# Main function, start the server
 def start_server():
-    global tuple_space, total_clients, total_operations, total_reads, total_gets, total_puts, total_errors
-    tuple_space = {}
-    total_clients = 0
-    total_operations = 0
-    total_reads = 0
-    total_gets = 0
-    total_puts = 0
-    total_errors = 0
-
-    # This condition determines whether the number of command-line arguments is 2 (script name and port number). 
-    if len(sys.argv) != 2:
-        print("Usage: python server.py <port>")
+    global tuple_space, stats
+
+    # The port number is required, everything after it is an optional --name value pair.
+    if len(sys.argv) < 2:
+        print("Usage: python server.py <port> [--mode thread|async] [--backlog N] [--shards N] [--storage dict|compact]\n"
+              "                        [--workers N] [--wal DIR] [--snapshot-every N]\n"
+              "                        [--metrics-port N] [--metrics-file PATH] [--metrics-interval SECONDS] "
+              "[--log-level DEBUG|INFO|WARNING]")
         return
     port = int(sys.argv[1])
    # Then check if the port number is in the range of 50000 to 59999
     if not 50000 <= port <= 59999:
         print("Port number should be between 50000 and 59999")
         return
+    try:
+        options = parse_options(sys.argv[2:], DEFAULT_OPTIONS)
+        setup_logging(options['log-level'])
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    if options['mode'] not in ('thread', 'async'):
+        print("Mode should be thread or async")
+        return
+    if options['storage'] not in ('dict', 'compact'):
+        print("Storage should be dict or compact")
+        return
+    if options['workers'] > 1:
+        # Each worker owns one partition of the keys and runs its own event loop on its own core
+        start_workers(port, options)
+        return
+    tuple_space = create_tuple_space(options)
+    stats = OperationStats()
+    if options['wal']:
+        if os.path.exists(os.path.join(options['wal'], 'partitions')):
+            print("The log directory was written by worker processes, start the server with the same --workers")
+            return
+        open_wal(options['wal'], options)
+    metrics.start_exports(options)
+
+    # Start the thread that prints the tuple space information
+    summary_thread = threading.Thread(target=print_tuple_space_summary)
+    summary_thread.daemon = True
+    summary_thread.start()
+
+    if options['mode'] == 'async':
+        # One event loop multiplexes every connection, so no thread is created per client
+        raise_file_limit()
+        print(f"Server is running on port {port} (async mode), waiting for clients...")
+        try:
+            asyncio.run(serve_async(port, options['backlog']))
+        except KeyboardInterrupt:
+            pass
+        return
+
 # Create a TCP socket
-    server_socket = socket.socket(socket.AF_INET, socket. SOCK_STREAM)
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     # Set socket options to allow address reuse
-    server_socket.setsockopt(socket. SOL_SOCKET, socket. SO_REUSEADDR, 1)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     # To bind the address and port, here we use the idea of bind in the lecture
     server_socket.bind(('localhost', port))
     # Start listening for the connection, corresponding to the listen in the lecture
-    server_socket.listen(5)
+    server_socket.listen(options['backlog'])
     print(f"Server is running on port {port}, waiting for clients...")
 
-    # Start the thread that prints the tuple space information
-    summary_thread = threading. Thread(target=print_tuple_space_summary)
-    summary_thread.daemon = True
-    summary_thread.start()
-while True:
+    while True:
         # Accept client connections
         client_socket, client_address = server_socket.accept()
         # Create a new thread for each client to process the request
-        client_thread = threading. Thread(target=handle_client, args=(client_socket, client_address))
+        client_thread = threading.Thread(target=handle_client, args=(client_socket, client_address))
         client_thread.start()
 
 
 if __name__ == "__main__":
     start_server()
-
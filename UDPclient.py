@@ -2,9 +2,197 @@ import socket
 import sys
 import os
 import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+
+from common import parse_options
+from udp_protocol import ETHERNET_BLOCK_SIZE, MAX_BLOCK_SIZE, MAX_DATAGRAM, MAX_TEXT_BLOCK_SIZE, TEXT_BLOCK_SIZE
+from udp_protocol import decode_data_header, parse_reply_fields
+
+# Option defaults for the client, each one can be overridden with --name value on the command line
+DEFAULT_OPTIONS = {
+    'window': 64,  # Most block requests in flight at once, 1 gives the original stop-and-wait transfer
+    'text': False,  # Ask for the original Base64 text block replies instead of binary data frames
+    'block-size': 0,  # Bytes per block, 0 for the largest that fits an Ethernet frame (binary) or 1000 (text)
+    'parallel': 1,  # Files downloaded at the same time, each over its own socket
+    'fresh': False,  # Download every file from the start and keep no record of progress to resume from
+    'min-rto': 10,  # Lowest retransmission timeout in milliseconds
+}
+
+# A block is taken as lost once this many blocks requested after it have arrived, without waiting for its timeout
+REORDER_THRESHOLD = 3
+
+SAVE_INTERVAL = 1.0  # Seconds between writes of the progress record of a download
+
+PROGRESS_INTERVAL = 0.5  # Seconds between the "*" progress marks of a download
+
+MAX_RTO = 60.0  # Highest retransmission timeout in seconds
+
+
+# Retransmission timeout from measured round trip times, as in RFC 6298: SRTT and RTTVAR are smoothed with
+# gains 1/8 and 1/4 and the timeout is SRTT + 4 * RTTVAR. Only replies to requests sent once are measured
+# (Karn's algorithm), because a reply to a retransmitted request cannot be matched to the send it answers.
+# A timeout doubles the RTO, which stays doubled until the next measurement. The RFC's 1 second lower bound
+# would stall a LAN transfer for a second per lost datagram, so the bound is min_rto instead.
+class RttEstimator:
+    def __init__(self, initial_rto, min_rto):
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.srtt = None
+        self.rttvar = None
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_rto), MAX_RTO)
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, MAX_RTO)
+
+
+# Hashes a file as it downloads. Blocks arrive out of order, so only the run of complete blocks at the start of
+# the file is hashed. A block that extends that run is hashed straight from the receive buffer when it is
+# written; blocks that arrived ahead of it, or were written by an earlier attempt, are read back from the file
+# once the run reaches them. When the last block arrives the digest is nearly done.
+class FileHasher:
+    def __init__(self, file):
+        self.file = file  # The file being downloaded, opened for reading and writing
+        self.sha256 = hashlib.sha256()
+        self.hashed = 0  # Bytes hashed so far
+
+    def update(self, data):
+        # Hash a block that starts where the hashed part of the file ends
+        self.sha256.update(data)
+        self.hashed += len(data)
+
+    def advance(self, end):
+        # Every byte before end is now in the file, hash the ones that have not been hashed yet
+        if self.hashed >= end:
+            return
+        self.file.seek(self.hashed)
+        while self.hashed < end:
+            chunk = self.file.read(min(end - self.hashed, 1024 * 1024))
+            if not chunk:
+                break
+            self.update(chunk)
+
+    def result(self):
+        return self.sha256.hexdigest()
+
+
+# Numbers about one download, printed when it ends and kept in UDPClient.transfer_stats
+class TransferStats:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.elapsed = 0.0
+        self.bytes_received = 0  # File bytes received in this attempt, without duplicates
+        self.requests = 0  # Requests sent, retransmissions included
+        self.retransmits = 0
+        self.timeouts = 0
+        self.rtt_samples = 0
+        self.min_rtt = None
+        self.srtt = None  # Smoothed RTT and RTO of the client when the download ended
+        self.rto = None
+
+    def add_rtt(self, rtt):
+        self.rtt_samples += 1
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+
+    def finish(self, estimator):
+        self.elapsed = time.monotonic() - self.start
+        self.srtt = estimator.srtt
+        self.rto = estimator.rto
+
+    def goodput(self):
+        # Useful file bytes per second
+        return self.bytes_received / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        srtt = f"{self.srtt * 1000:.3f} ms" if self.srtt is not None else "n/a"
+        min_rtt = f"{self.min_rtt * 1000:.3f} ms" if self.min_rtt is not None else "n/a"
+        return (f"{self.bytes_received} bytes in {self.elapsed:.2f}s, goodput {self.goodput() / 1e6:.2f} MB/s, "
+                f"{self.requests} requests, {self.retransmits} retransmits, {self.timeouts} timeouts, "
+                f"srtt {srtt}, min rtt {min_rtt}, rto {self.rto * 1000:.1f} ms")
+
+
+# Progress of one download, kept next to the file as <name>.part so that an interrupted download continues where
+# it stopped. The first line is "SIZE n BLOCK b [DIGEST sha256]", every other line a range "first last" of block
+# numbers that are on disk. Ranges are only written after the file has been synced, so a crash can lose progress
+# but never record a block that is not there. The record is removed once the file is complete.
+class ResumeRecord:
+    def __init__(self, filename, file_size, block_size, digest=None):
+        self.path = filename + ".part"
+        self.filename = filename
+        self.header = f"SIZE {file_size} BLOCK {block_size}"
+        if digest:
+            self.header += f" DIGEST {digest}"  # A file changed on the server at the same size is not resumed
+        self.block_count = (file_size + block_size - 1) // block_size
+        self.pending = []  # Blocks written since the last save
+        self.last_save = time.monotonic()
+
+    def load(self):
+        # Return the done flags of every block saved by an earlier attempt, or None to start from the beginning
+        if not os.path.exists(self.filename) or not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as record:
+            lines = record.read().split('\n')
+        if lines[0] != self.header:
+            return None  # The file on the server, its digest or the block size changed
+        done = bytearray(self.block_count)
+        for line in lines[1:]:
+            parts = line.split()
+            # The last line may be cut short by the crash that interrupted the download
+            if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
+                continue
+            first, last = int(parts[0]), min(int(parts[1]), self.block_count - 1)
+            done[first:last + 1] = b'\x01' * max(last - first + 1, 0)
+        return done
+
+    def start(self):
+        # Begin a new record for a download that starts from the first block
+        with open(self.path, 'w', encoding='utf-8') as record:
+            record.write(self.header + '\n')
+
+    def add(self, block, file):
+        self.pending.append(block)
+        if time.monotonic() - self.last_save >= SAVE_INTERVAL:
+            self.save(file)
+
+    def save(self, file):
+        # Sync the blocks written since the last save, then append them to the record as ranges
+        self.last_save = time.monotonic()
+        if not self.pending:
+            return
+        file.flush()
+        os.fsync(file.fileno())
+        self.pending.sort()
+        ranges = []
+        first = last = self.pending[0]
+        for block in self.pending[1:]:
+            if block != last + 1:
+                ranges.append(f"{first} {last}\n")
+                first = block
+            last = block
+        ranges.append(f"{first} {last}\n")
+        self.pending = []
+        with open(self.path, 'a', encoding='utf-8') as record:
+            record.write(''.join(ranges))
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 
 class UDPClient:
-    def __init__(self, hostname, port, file_list):
+    def __init__(self, hostname, port, file_list, options=None):
+        options = options or DEFAULT_OPTIONS
+        self.options = options
         self.server_host = hostname
         self.server_port = port
         self.file_list = file_list
@@ -12,21 +200,54 @@ class UDPClient:
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.initial_timeout = 1000  # 1 second in milliseconds (help for A4: Timeout Setting)
         self.max_retries = 5
+        # Round trip times are measured over every request to the server, so later files start with a good RTO
+        self.rtt = RttEstimator(self.initial_timeout / 1000, options['min-rto'] / 1000)
+        self.transfer_stats = {}  # file name -> TransferStats of its last download
+        self.max_window = max(1, options['window'])
+        self.binary = not options['text']
+        self.block_size = options['block-size']
+        self.parallel = max(1, options['parallel'])
+        self.fresh = options['fresh']
+        # Every datagram is received into this one buffer, binary blocks are written to the file from a view of it
+        self.buffer = bytearray(MAX_DATAGRAM)
+        self.view = memoryview(self.buffer)
+        try:
+            # Room for a full window of large blocks that arrive faster than they are written
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except OSError:
+            pass
 
-    def send_and_receive(self, message, address, port):
+    # Send message until a reply starting with one of the expected prefixes arrives. Other datagrams, such as late
+    # duplicates of blocks from a windowed transfer, are skipped without resending. With sample_rtt=False the reply
+    # is not used as a round trip time, for requests the server may take a while to answer.
+    def send_and_receive(self, message, address, port, expected=("",), stats=None, sample_rtt=True):
         retries = 0
-        current_timeout = self.initial_timeout
         while retries < self.max_retries:
             try:
                 # Send message and set timeout (Lecture 7: UDP Timeout Handling)
                 self.socket.sendto(message.encode('utf-8'), (address, port))
-                self.socket.settimeout(current_timeout / 1000)
-                response, _ = self.socket.recvfrom(65536)
-                return response.decode('utf-8').strip()
+                if stats:
+                    stats.requests += 1
+                    stats.retransmits += retries > 0
+                sent = time.monotonic()
+                deadline = sent + self.rtt.rto
+                while True:
+                    self.socket.settimeout(max(deadline - time.monotonic(), 0.001))
+                    response, _ = self.socket.recvfrom(65536)
+                    response = response.decode('utf-8', errors='replace').strip()
+                    if response.startswith(expected):
+                        if retries == 0 and sample_rtt:
+                            rtt = time.monotonic() - sent
+                            self.rtt.sample(rtt)
+                            if stats:
+                                stats.add_rtt(rtt)
+                        return response
             except socket.timeout:
                 # Implement exponential backoff on timeout (help for A4: Retry Mechanism)
                 retries += 1
-                current_timeout *= 2
+                self.rtt.backoff()
+                if stats:
+                    stats.timeouts += 1
                 print(f"Timeout, retry {retries}/{self.max_retries}")
             except Exception as e:
                 print(f"Error: {e}")
@@ -35,10 +256,18 @@ class UDPClient:
 
     def download_file(self, filename):
         print(f"\nDownloading: {filename}")
+        stats = TransferStats()
+        self.transfer_stats[filename] = stats
         try:
             # Step 1: Send DOWNLOAD request (Protocol specification)
-            download_msg = f"DOWNLOAD {filename}"
-            response = self.send_and_receive(download_msg, self.server_host, self.server_port)
+            download_msg = f"DOWNLOAD {filename} BINARY" if self.binary else f"DOWNLOAD {filename}"
+            # The server hashes a file before its first OK, so the wait for the OK is not a round trip time
+            response = self.send_and_receive(download_msg, self.server_host, self.server_port,
+                                             (f"OK {filename} ", f"ERR {filename} "), stats, sample_rtt=False)
+            if self.binary and response == f"ERR {filename} BINARY NOT_FOUND":
+                # A server that does not know BINARY looks for a file named "name BINARY", ask again for text blocks
+                response = self.send_and_receive(f"DOWNLOAD {filename}", self.server_host, self.server_port,
+                                                 (f"OK {filename} ", f"ERR {filename} "), stats, sample_rtt=False)
 
             if response.startswith("ERR"):
                 print(f"Error: {response}")
@@ -52,51 +281,215 @@ class UDPClient:
 
             file_size = int(parts[3])
             data_port = int(parts[5])
-            print(f"File size: {file_size} bytes, using port {data_port}")
+            fields = parse_reply_fields(parts)
+            # Text blocks unless the server confirmed BINARY
+            binary = fields.get("MODE") == "BINARY"
+            # Requests name the session when the server gave one, a server that did not knows us by address
+            session_id = int(fields["SESSION"]) if "SESSION" in fields else None
+            digest = fields.get("DIGEST")
+            if binary:
+                block_size = min(self.block_size or ETHERNET_BLOCK_SIZE, MAX_BLOCK_SIZE)
+            else:
+                block_size = min(self.block_size or TEXT_BLOCK_SIZE, MAX_TEXT_BLOCK_SIZE)
+            print(f"File size: {file_size} bytes, using port {data_port}, {'binary' if binary else 'text'} "
+                  f"blocks of {block_size} bytes")
+
+            record = None if self.fresh else ResumeRecord(filename, file_size, block_size, digest)
+            done = record.load() if record else None
+            if done is not None:
+                print(f"Resuming: {sum(done)} of {len(done)} blocks already on disk")
 
             # Step 2: Download file in blocks (Protocol specification)
-            with open(filename, 'wb') as file:
-                bytes_received = 0
-                block_size = 1000
-                while bytes_received < file_size:
-                    start = bytes_received
-                    end = min(start + block_size - 1, file_size - 1)
-                    request_msg = f"FILE {filename} GET START {start} END {end}"
-                    response = self.send_and_receive(request_msg, self.server_host, data_port)
-
-                    # Parse response (limit split to protect DATA field)
-                    parts = response.split(' ', 7)
-                    # Validate block response format (Protocol specification)
-                    if len(parts) < 8 or parts[0] != "FILE" or parts[2] != "OK":
-                        print(f"Invalid block response: {response}")
-                        continue
-
-                    base64_data = parts[7]
-                    # Decode Base64 data to binary (help for A4: Base64 Decoding)
-                    file_data = base64.b64decode(base64_data)
-                    file.write(file_data)
-                    bytes_received += len(file_data)
-                    print("*", end='', flush=True)
+            # Keep the blocks an earlier attempt wrote, otherwise start from an empty file. Either way the file can
+            # be read as well, for the hasher.
+            with open(filename, 'r+b' if done is not None else 'w+b') as file:
+                file.truncate(file_size)
+                if record and done is None:
+                    record.start()
+                hasher = FileHasher(file) if digest else None
+                try:
+                    self.receive_blocks(file, filename, file_size, data_port, block_size, binary, session_id,
+                                        done, record, stats, hasher)
+                finally:
+                    if record:
+                        record.save(file)
+                    received_digest = hasher.result() if hasher else None
+                if digest and received_digest != digest:
+                    # Some block was corrupted on the way or on disk, start the file again next time
+                    if record:
+                        record.remove()
+                    raise Exception(f"SHA-256 of {filename} is {received_digest}, the server sent {digest}")
 
                 # Step 3: Send CLOSE request (Protocol specification)
                 close_msg = f"FILE {filename} CLOSE"
-                self.send_and_receive(close_msg, self.server_host, data_port)
-                print(f"\nDownload complete: {filename}")
+                if session_id is not None:
+                    close_msg += f" SESSION {session_id}"
+                self.send_and_receive(close_msg, self.server_host, data_port, (f"FILE {filename} CLOSE_OK",), stats)
+                stats.finish(self.rtt)
+                print(f"\nDownload complete: {filename} ({stats.summary()})")
+            if record:
+                record.remove()
 
             return True
 
         except Exception as e:
-            print(f"\nDownload failed: {e}")
+            stats.finish(self.rtt)
+            print(f"\nDownload failed: {e} ({stats.summary()})")
             return False
 
+    # Fetch every block of the file with up to max_window requests in flight and write each one at its offset.
+    # The window starts at one block and grows by one per reply up to the threshold, then by one per window;
+    # a loss halves it, like TCP congestion control. A block is lost when its timeout passes or when
+    # REORDER_THRESHOLD blocks requested after it have arrived, and only lost blocks are requested again.
+    # done marks blocks already on disk, record is told about every block written and hasher about every byte
+    # of the file that is complete from the start. Timeouts come from the client's RTT estimator, which measures
+    # every block whose request was sent only once. Binary blocks that fail their CRC are dropped and requested
+    # again like lost ones.
+    def receive_blocks(self, file, filename, file_size, data_port, block_size, binary, session_id=None,
+                       done=None, record=None, stats=None, hasher=None):
+        stats = stats or TransferStats()
+        address = (self.server_host, data_port)
+        session_suffix = f" SESSION {session_id}" if session_id is not None else ""
+        block_count = (file_size + block_size - 1) // block_size
+        if done is None:
+            done = bytearray(block_count)
+        # Blocks still to request, retransmissions go to the front
+        to_send = deque(block for block in range(block_count) if not done[block])
+        in_flight = OrderedDict()  # block -> (send sequence, send time), oldest request first
+        attempts = [0] * block_count
+        remaining = len(to_send)
+        complete = 0  # Blocks before this one are all on disk
+
+        def advance_complete():
+            nonlocal complete
+            first = complete
+            while complete < block_count and done[complete]:
+                complete += 1
+            if hasher and complete > first:
+                hasher.advance(min(complete * block_size, file_size))
+
+        advance_complete()
+        last_progress = time.monotonic()
+        window = 1.0
+        threshold = float(self.max_window)
+        sequence = 0
+        recovery = 0  # Losses of requests sent before this sequence belong to a loss the window already reacted to
+
+        def mark_lost(blocks):
+            nonlocal window, threshold, recovery
+            for block in blocks:
+                sent_sequence, _ = in_flight.pop(block)
+                if sent_sequence > recovery:
+                    threshold = max(window / 2, 1.0)
+                    window = threshold
+                    recovery = sequence
+            to_send.extendleft(reversed(blocks))
+
+        while remaining:
+            # Fill the window, skipping blocks whose earlier request was answered after all
+            while to_send and len(in_flight) < int(window):
+                block = to_send.popleft()
+                if done[block]:
+                    continue
+                start = block * block_size
+                end = min(start + block_size, file_size) - 1
+                request = f"FILE {filename} GET START {start} END {end}{session_suffix}"
+                self.socket.sendto(request.encode('utf-8'), address)
+                attempts[block] += 1
+                stats.requests += 1
+                stats.retransmits += attempts[block] > 1
+                sequence += 1
+                in_flight[block] = (sequence, time.monotonic())
+
+            # Each request times out after the RTO, doubling with every attempt at the same block
+            now = time.monotonic()
+            deadlines = {block: sent + self.rtt.rto * 2 ** (attempts[block] - 1)
+                         for block, (_, sent) in in_flight.items()}
+            expired = [block for block, deadline in deadlines.items() if deadline <= now]
+            if expired:
+                self.rtt.backoff()
+                stats.timeouts += len(expired)
+                for block in expired:
+                    print(f"Timeout, retry {attempts[block]}/{self.max_retries} for block {block}")
+                    if attempts[block] >= self.max_retries:
+                        raise Exception("Max retries exceeded")
+                mark_lost(expired)
+                continue
+            self.socket.settimeout(min(deadlines.values()) - now)
+            try:
+                size, sender = self.socket.recvfrom_into(self.buffer)
+            except socket.timeout:
+                continue
+            if sender[1] != data_port:
+                continue  # Late reply from the transfer of an earlier file
+
+            if binary:
+                header = decode_data_header(self.buffer, size)
+                if header is None or header[0] != (session_id or 0):
+                    continue  # Not a data frame of this download
+                _, start, length = header
+                data = self.view[size - length:size]
+            else:
+                # Parse response (limit split to protect DATA field)
+                parts = bytes(self.view[:size]).decode('utf-8', errors='replace').split(' ', 8)
+                # Validate block response format (Protocol specification)
+                if len(parts) < 9 or parts[0] != "FILE" or parts[1] != filename or parts[2] != "OK" or parts[7] != "DATA":
+                    continue
+                # Decode Base64 data to binary (help for A4: Base64 Decoding)
+                try:
+                    start = int(parts[4])
+                    data = base64.b64decode(parts[8])
+                except ValueError:
+                    continue  # Damaged on the way, it is requested again like a lost block
+            block = start // block_size
+            if start % block_size or block >= block_count or done[block]:
+                continue  # Duplicate of a block that was requested twice
+            if len(data) != min(start + block_size, file_size) - start:
+                continue
+
+            file.seek(start)
+            file.write(data)
+            done[block] = 1
+            remaining -= 1
+            stats.bytes_received += len(data)
+            if block == complete:
+                if hasher:
+                    hasher.update(data)  # Still in the receive buffer, no need to read it back
+                advance_complete()
+            if record:
+                record.add(block, file)
+            # One mark per block would be a write to the terminal per datagram, so mark progress on a timer
+            if now - last_progress >= PROGRESS_INTERVAL:
+                last_progress = now
+                print("*", end='', flush=True)
+
+            window = min(window + (1 if window < threshold else 1 / window), self.max_window)
+            if block in in_flight:
+                sent_sequence, sent = in_flight.pop(block)
+                if attempts[block] == 1:
+                    rtt = time.monotonic() - sent
+                    self.rtt.sample(rtt)
+                    stats.add_rtt(rtt)
+                # Requests sent well before this one should have arrived by now
+                overtaken = []
+                for other, (other_sequence, _) in in_flight.items():
+                    if other_sequence + REORDER_THRESHOLD > sent_sequence:
+                        break
+                    overtaken.append(other)
+                if overtaken:
+                    mark_lost(overtaken)
+
     def run(self):
         try:
             # Read file list (File I/O operation)
             with open(self.file_list, 'r', encoding='utf-8') as f:
                 files = [line.strip() for line in f if line.strip()]
 
-            for filename in files:
-                self.download_file(filename)
+            if self.parallel > 1:
+                self.download_parallel(files)
+            else:
+                for filename in files:
+                    self.download_file(filename)
 
         except Exception as e:
             print(f"Error: {e}")
@@ -104,9 +497,44 @@ class UDPClient:
             # Close socket to release resources (Resource management)
             self.socket.close()
 
+    # Download the files with up to self.parallel transfers at once. Each worker is a client of its own, so
+    # every transfer has its own socket, buffer and window.
+    def download_parallel(self, files):
+        queue = deque(files)
+        results = []
+
+        def work(client):
+            try:
+                while True:
+                    try:
+                        filename = queue.popleft()
+                    except IndexError:
+                        return
+                    results.append(client.download_file(filename))
+            finally:
+                client.socket.close()
+
+        workers = [
+            threading.Thread(target=work,
+                             args=(UDPClient(self.server_host, self.server_port, self.file_list, self.options),))
+            for _ in range(min(self.parallel, len(files)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        print(f"\n{sum(results)} of {len(files)} files downloaded")
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python UDPclient.py <hostname> <port> <file_list>")
+    if len(sys.argv) < 4:
+        print("Usage: python UDPclient.py <hostname> <port> <file_list> [--window N] [--text] [--block-size N]\n"
+              "                           [--parallel N] [--fresh] [--min-rto MS]")
+        sys.exit(1)
+    try:
+        options = parse_options(sys.argv[4:], DEFAULT_OPTIONS)
+    except ValueError as e:
+        print(f"Error: {e}")
         sys.exit(1)
-    client = UDPClient(sys.argv[1], int(sys.argv[2]), sys.argv[3])
+    client = UDPClient(sys.argv[1], int(sys.argv[2]), sys.argv[3], options)
     client.run()
@@ -2,15 +2,175 @@ import socket
 import threading
 import random
 import os
+import asyncio
 import base64
+import hashlib
+import logging
+import mmap
 import time
+from collections import OrderedDict
+
+from common import parse_options
+from metrics import METRICS_OPTIONS, Metrics, setup_logging
+from udp_protocol import MAX_BLOCK_SIZE, MAX_SESSION_ID, encode_data_header, parse_file_request
+
+log = logging.getLogger('udp_server')
+
+# Option defaults for the server, each one can be overridden with --name value on the command line
+DEFAULT_OPTIONS = {
+    'cache-files': 64,  # Files kept mapped after their last download ends, for the next download of them
+    'mode': 'thread',  # thread: a thread and a socket per download, async: one event loop for every download
+    'sockets': 1,  # Async mode sockets that sessions are spread over, the first one is the server port
+    'session-timeout': 30.0,  # Seconds without a request after which a download is dropped
+    **METRICS_OPTIONS,
+}
+
+
+# One version of a file mapped into memory, shared by every download of it
+class CachedFile:
+    def __init__(self, path, key, data):
+        self.path = path
+        self.key = key  # (mtime, size) of the file when it was mapped
+        self.size = len(data)
+        self.data = data  # mmap of the file, or b'' for an empty file, which cannot be mapped
+        self.view = memoryview(data)  # Blocks are sent as slices of this view, without copying them
+        self.users = 0
+        self.digest_lock = threading.Lock()  # Held while the file is hashed, so it is hashed only once
+
+    def close(self):
+        # A block that is still being sent is a slice of the map and keeps it from being closed. The map is then
+        # unmapped when the last slice is freed instead.
+        try:
+            self.view.release()
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
+        except BufferError:
+            pass
+
+
+# Memory maps of the files being served, keyed by path and checked against the file's mtime and size.
+# Downloads of the same file share one map and a map stays open while any download uses it. Unused maps are
+# kept for the next download and closed least recently used first once there are more than max_files.
+# A file changed on disk is mapped again for new downloads, the old map is closed when its last download ends.
+class FileCache:
+    def __init__(self, max_files=64):
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.files = {}  # path -> CachedFile of the newest version of the file
+        self.idle = OrderedDict()  # CachedFile objects no download uses, least recently used first
+        self.digests = {}  # path -> ((mtime, size), SHA-256), kept after the map is closed
+
+    def acquire(self, path):
+        # Return the CachedFile for path, mapping it if needed. Raises OSError if it cannot be opened.
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is not None and entry.key == key:
+                entry.users += 1
+                self.idle.pop(entry, None)
+                return entry
+
+        with open(path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        entry = CachedFile(path, key, data)
+        entry.users = 1
+        with self.lock:
+            old = self.files.get(path)
+            self.files[path] = entry
+            if old is not None and old.users == 0:
+                self.idle.pop(old, None)
+                old.close()
+        return entry
+
+    def cached_digest(self, entry):
+        # Return the SHA-256 of the file if it is already known, otherwise None
+        with self.lock:
+            cached = self.digests.get(entry.path)
+        return cached[1] if cached and cached[0] == entry.key else None
+
+    def digest(self, entry):
+        # Return the SHA-256 of the file, hashing it only the first time this version of it is served.
+        # Downloads that start while it is being hashed wait for the same result.
+        with entry.digest_lock:
+            digest = self.cached_digest(entry)
+            if digest is None:
+                digest = hashlib.sha256(entry.view).hexdigest()
+                with self.lock:
+                    self.digests[entry.path] = (entry.key, digest)
+            return digest
+
+    def release(self, entry):
+        # Called when a download of the file ends
+        with self.lock:
+            entry.users -= 1
+            if entry.users:
+                return
+            if self.files.get(entry.path) is not entry:
+                entry.close()  # Replaced by a newer version of the file
+                return
+            self.idle[entry] = None
+            while len(self.idle) > self.max_files:
+                old, _ = self.idle.popitem(last=False)
+                del self.files[old.path]
+                old.close()
+
+
+# One download: the shared map of the file, the client it goes to and how its blocks are sent
+class Session:
+    def __init__(self, session_id, entry, address, binary):
+        self.session_id = session_id
+        self.entry = entry
+        self.address = address
+        self.binary = binary
+        self.last_seen = time.monotonic()
+        self.protocol = None  # Async mode socket that serves the session
+        self.digest = None  # SHA-256 of the file, sent in the OK reply
+        self.ok_msg = None  # Thread mode: the OK reply once it has been sent, repeated for a repeated DOWNLOAD
+
+
+# Receives the datagrams of one socket of the async server and sends its replies
+class TransferProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.port = sock.getsockname()[1]
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server.handle_datagram(self, data, addr)
+
+    def error_received(self, exc):
+        log.error("[ERROR] Socket error: %s", exc)
+
+    def send(self, parts, address):
+        # Send straight from the socket with sendmsg, let the transport queue the datagram if the buffer is full
+        try:
+            UDPServer.send_parts(self.sock, parts, address)
+        except BlockingIOError:
+            self.transport.sendto(b''.join(parts), address)
 
 
 class UDPServer:
-    def __init__(self, port):
+    def __init__(self, port, options=None):
+        options = options or DEFAULT_OPTIONS
+        self.options = options
         self.server_port = port
         self.welcome_socket = None
         self.running = False
+        self.metrics = Metrics()
+        self.cache = FileCache(options['cache-files'])
+        self.mode = options['mode']
+        self.socket_count = max(1, options['sockets'])
+        self.session_timeout = options['session-timeout']
+        self.last_session_id = 0
+        self.sessions = {}  # Async mode: session id -> Session
+        self.session_keys = {}  # (client address, file name) -> Session of the download in progress
+        self.session_lock = threading.Lock()  # Thread mode: guards session_keys, which download threads update
+        self.protocols = []  # Async mode: TransferProtocol of every socket
         self.start_server()
 
     def start_server(self):
@@ -22,10 +182,10 @@ class UDPServer:
             # Bind socket to all interfaces on specified port (Lecture 5: Socket Binding)
             self.welcome_socket.bind(('', self.server_port))
             self.running = True
-            print(f"[SERVER] Started on port {self.server_port}")
+            log.info("[SERVER] Started on port %s", self.server_port)
         except OSError as e:
-            print(f"[ERROR] Failed to start server: {e}")
-            print(f"[TIP] Try another port or wait 1-2 minutes for OS to release the port")
+            log.error("[ERROR] Failed to start server: %s", e)
+            log.error("[TIP] Try another port or wait 1-2 minutes for OS to release the port")
             self.cleanup()
             raise
 
@@ -35,92 +195,300 @@ class UDPServer:
             self.welcome_socket.close()
         self.running = False
 
-    def handle_client(self, filename, file_size, client_address):
+    # Send a datagram made of several buffers. sendmsg gathers them in the kernel without joining them first,
+    # platforms without it get one joined copy.
+    @staticmethod
+    def send_parts(sock, parts, address):
+        if hasattr(sock, 'sendmsg'):
+            sock.sendmsg(parts, [], 0, address)
+        else:
+            sock.sendto(b''.join(parts), address)
+
+    # Return the message that accepts a download and tells the client where to send its requests
+    @staticmethod
+    def ok_message(session, port):
+        ok_msg = f"OK {session.entry.path} SIZE {session.entry.size} PORT {port}"
+        if session.binary:
+            ok_msg += " MODE BINARY"
+        return ok_msg + f" SESSION {session.session_id} DIGEST {session.digest}"
+
+    # Return the datagram parts that answer a GET of bytes start to end, or None if the range is not valid.
+    # Blocks are slices of the shared map of the file, nothing is read or copied.
+    @staticmethod
+    def block_reply(session, start, end):
+        entry = session.entry
+        end = min(end, entry.size - 1)
+        if start < 0 or end < start or (session.binary and end - start + 1 > MAX_BLOCK_SIZE):
+            return None
+        block = entry.view[start:end + 1]
+        if session.binary:
+            return [encode_data_header(session.session_id, start, block), block]
+        # Encode binary data to Base64 for text-based protocol (help for A4: Base64 Encoding)
+        base64_data = base64.b64encode(block).decode('utf-8')
+        return [f"FILE {entry.path} OK START {start} END {end} DATA {base64_data}".encode('utf-8')]
+
+    # Return (file name, binary) of a DOWNLOAD request. "DOWNLOAD name BINARY" asks for raw data frames instead
+    # of Base64 text.
+    @staticmethod
+    def download_name(request):
+        filename = request[9:].strip()
+        binary = filename.endswith(" BINARY")
+        if binary:
+            filename = filename[:-7].strip()
+        return filename, binary
+
+    # Start a download for a DOWNLOAD request, or return (None, error message) if the file cannot be served
+    def open_session(self, request, client_address):
+        filename, binary = self.download_name(request)
+        try:
+            # Map the file, or share the map that earlier downloads of it already use
+            entry = self.cache.acquire(filename)
+        except OSError:
+            self.metrics.count('not_found')
+            return None, f"ERR {filename} NOT_FOUND"
+        self.last_session_id = self.last_session_id % MAX_SESSION_ID + 1
+        self.metrics.count('downloads')
+        self.metrics.add_gauge('active_sessions', 1)
+        return Session(self.last_session_id, entry, client_address, binary), None
+
+    # Record one block reply. started is the perf_counter() reading taken when its request arrived.
+    def count_block(self, session, parts, started):
+        self.metrics.count('blocks_sent')
+        self.metrics.count('bytes_sent', sum(len(part) for part in parts))
+        self.metrics.observe('GET binary' if session.binary else 'GET text', time.perf_counter() - started)
+
+    def handle_client(self, session):
         client_socket = None
+        filename = session.entry.path
         try:
             # Allocate random port for client data transfer (50000-51000) (help for A4: Port Allocation)
             client_port = random.randint(50000, 51000)
             client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             client_socket.bind(('', client_port))
+            # A client that disappears without CLOSE must not keep the thread and port forever
+            client_socket.settimeout(self.session_timeout)
+            session.digest = self.cache.digest(session.entry)
 
             # Send OK response with file size and data port (Protocol specification from assignment)
-            ok_msg = f"OK {filename} SIZE {file_size} PORT {client_port}"
-            self.welcome_socket.sendto(ok_msg.encode('utf-8'), client_address)
-            print(f"[SERVER] Sent to {client_address}: {ok_msg}")
+            ok_msg = session.ok_msg = self.ok_message(session, client_port)
+            self.welcome_socket.sendto(ok_msg.encode('utf-8'), session.address)
+            log.info("[SERVER] Sent to %s: %s", session.address, ok_msg)
 
-            with open(filename, 'rb') as file:
-                while self.running:
-                    try:
-                        # Receive client request on data port (Lecture 7: UDP Data Reception)
-                        data, addr = client_socket.recvfrom(65536)
-                        request = data.decode('utf-8').strip()
-                        print(f"[SERVER] Received: {request} from {addr}")
-
-                        # Handle CLOSE request to terminate connection (Protocol specification)
-                        if request == f"FILE {filename} CLOSE":
-                            client_socket.sendto(
-                                f"FILE {filename} CLOSE_OK".encode('utf-8'),
-                                addr
-                            )
-                            break
-
-                        # Process block data request (Protocol specification)
-                        if request.startswith(f"FILE {filename} GET START"):
-                            parts = request.split()
-                            start = int(parts[4])
-                            end = int(parts[6])
-                            file.seek(start)
-                            block = file.read(end - start + 1)
-
-                            # Encode binary data to Base64 for text-based protocol (help for A4: Base64 Encoding)
-                            base64_data = base64.b64encode(block).decode('utf-8')
-                            response = (
-                                f"FILE {filename} OK START {start} END {end} "
-                                f"DATA {base64_data}"
-                            )
-                            client_socket.sendto(response.encode('utf-8'), addr)
-                            print(f"[SERVER] Sent block {start}-{end} to {addr}")
-
-                    except Exception as e:
-                        print(f"[ERROR] Client handler: {e}")
+            while self.running:
+                try:
+                    # Receive client request on data port (Lecture 7: UDP Data Reception)
+                    data, addr = client_socket.recvfrom(65536)
+                    started = time.perf_counter()
+                    request = data.decode('utf-8').strip()
+                    log.debug("[SERVER] Received: %s from %s", request, addr)
+                    parsed = parse_file_request(request)
+                    if parsed is None or parsed[0] != filename or parsed[4] not in (None, session.session_id):
+                        self.metrics.count('invalid_requests')
+                        continue
+                    _, command, start, end, _ = parsed
+
+                    # Handle CLOSE request to terminate connection (Protocol specification)
+                    if command == "CLOSE":
+                        client_socket.sendto(
+                            f"FILE {filename} CLOSE_OK".encode('utf-8'),
+                            addr
+                        )
                         break
 
+                    # Process block data request (Protocol specification)
+                    parts = self.block_reply(session, start, end)
+                    if parts is None:
+                        self.metrics.count('invalid_requests')
+                        log.warning("[ERROR] Invalid block request: %s", request)
+                        continue
+                    try:
+                        self.send_parts(client_socket, parts, addr)
+                        self.count_block(session, parts, started)
+                    finally:
+                        del parts  # Drop the slice of the map, so the map can be closed when the download ends
+                    log.debug("[SERVER] Sent block %s-%s to %s", start, end, addr)
+
+                except socket.timeout:
+                    self.metrics.count('sessions_timed_out')
+                    log.info("[SERVER] Session %s for %s timed out", session.session_id, filename)
+                    break
+                except Exception as e:
+                    log.error("[ERROR] Client handler: %s", e)
+                    break
+
         except Exception as e:
-            print(f"[ERROR] Client thread failed: {e}")
+            log.error("[ERROR] Client thread failed: %s", e)
         finally:
-            if client_socket:
-                client_socket.close()
-            print(f"[SERVER] Closed connection for {filename}")
+            with self.session_lock:
+                del self.session_keys[(session.address, filename)]
+            try:
+                if client_socket:
+                    client_socket.close()
+                self.cache.release(session.entry)
+            finally:
+                self.metrics.add_gauge('active_sessions', -1)
+                self.metrics.retire()
+                log.info("[SERVER] Closed connection for %s", filename)
+
+    # Thread mode: every download gets its own thread and data socket
+    def serve_threads(self):
+        while self.running:
+            # Receive initial DOWNLOAD request on welcome socket (Lecture 7: UDP Protocol)
+            data, addr = self.welcome_socket.recvfrom(1024)
+            request = data.decode('utf-8').strip()
+            log.info("[SERVER] New request from %s: %s", addr, request)
+
+            # Process DOWNLOAD request (Protocol specification)
+            if request.startswith("DOWNLOAD"):
+                filename, _ = self.download_name(request)
+                with self.session_lock:
+                    session = self.session_keys.get((addr, filename))
+                if session is not None:
+                    # The client did not get the OK in time, often because the file is still being hashed.
+                    # Repeat the OK of the download it already started; one still hashing sends it when ready.
+                    if session.ok_msg is not None:
+                        self.welcome_socket.sendto(session.ok_msg.encode('utf-8'), addr)
+                        log.info("[SERVER] Sent again to %s: %s", addr, session.ok_msg)
+                    continue
+                session, err_msg = self.open_session(request, addr)
+                if session is None:
+                    # Send error response for non-existent file (Protocol specification)
+                    self.welcome_socket.sendto(err_msg.encode('utf-8'), addr)
+                    log.info("[SERVER] %s", err_msg)
+                    continue
+                with self.session_lock:
+                    self.session_keys[(addr, filename)] = session
+                # Create new thread for client (Lecture 5: Multithreading)
+                threading.Thread(
+                    target=self.handle_client,
+                    args=(session,),
+                    daemon=True
+                ).start()
+
+    # Async mode: one event loop serves every download. The server port takes DOWNLOAD requests and, with
+    # --sockets N, sessions are spread over it and N - 1 more sockets on ports chosen by the system. Requests
+    # find their session by the SESSION id, or by client address and file name if they carry none.
+    async def serve_async(self):
+        loop = asyncio.get_running_loop()
+        sockets = [self.welcome_socket]
+        for _ in range(self.socket_count - 1):
+            data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            data_socket.bind(('', 0))
+            sockets.append(data_socket)
+        for data_socket in sockets:
+            _, protocol = await loop.create_datagram_endpoint(
+                lambda data_socket=data_socket: TransferProtocol(self, data_socket), sock=data_socket)
+            self.protocols.append(protocol)
+        log.info("[SERVER] Serving downloads from %s socket(s) with asyncio", len(sockets))
+
+        # Drop the sessions of clients that stopped sending requests without a CLOSE
+        while self.running:
+            await asyncio.sleep(self.session_timeout / 4)
+            now = time.monotonic()
+            for session in [session for session in self.sessions.values()
+                            if now - session.last_seen > self.session_timeout]:
+                self.metrics.count('sessions_timed_out')
+                log.info("[SERVER] Session %s for %s timed out", session.session_id, session.entry.path)
+                self.end_session(session)
+
+    def send_ok(self, session, protocol):
+        ok_msg = self.ok_message(session, session.protocol.port)
+        protocol.send([ok_msg.encode('utf-8')], session.address)
+        log.info("[SERVER] Sent to %s: %s", session.address, ok_msg)
+
+    def digest_ready(self, session, protocol, future):
+        if self.sessions.get(session.session_id) is not session:
+            return  # Timed out while the file was hashed
+        try:
+            session.digest = future.result()
+        except Exception as e:
+            log.error("[ERROR] Hashing %s failed: %s", session.entry.path, e)
+            self.end_session(session)
+            return
+        self.send_ok(session, protocol)
+
+    def end_session(self, session):
+        del self.sessions[session.session_id]
+        del self.session_keys[(session.address, session.entry.path)]
+        self.cache.release(session.entry)
+        self.metrics.add_gauge('active_sessions', -1)
+
+    # Handle one datagram that arrived on any socket of the async server
+    def handle_datagram(self, protocol, data, addr):
+        started = time.perf_counter()
+        request = data.decode('utf-8', errors='replace').strip()
+        log.debug("[SERVER] Received: %s from %s", request, addr)
+
+        if request.startswith("DOWNLOAD"):
+            filename, _ = self.download_name(request)
+            # A repeated DOWNLOAD means the OK was lost, answer it again from the session it already started
+            session = self.session_keys.get((addr, filename))
+            if session is None:
+                session, err_msg = self.open_session(request, addr)
+                if session is None:
+                    protocol.send([err_msg.encode('utf-8')], addr)
+                    log.info("[SERVER] %s", err_msg)
+                    return
+                session.protocol = self.protocols[session.session_id % len(self.protocols)]
+                self.sessions[session.session_id] = session
+                self.session_keys[(addr, filename)] = session
+                session.digest = self.cache.cached_digest(session.entry)
+                if session.digest is None:
+                    # Hash the file off the event loop and answer once the digest is known
+                    future = asyncio.get_running_loop().run_in_executor(None, self.cache.digest, session.entry)
+                    future.add_done_callback(lambda future: self.digest_ready(session, protocol, future))
+                    return
+            if session.digest is not None:
+                self.send_ok(session, protocol)
+            return
+
+        try:
+            parsed = parse_file_request(request)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            self.metrics.count('invalid_requests')
+            log.warning("[ERROR] Invalid request: %s", request)
+            return
+        filename, command, start, end, session_id = parsed
+        if session_id is None:
+            session = self.session_keys.get((addr, filename))
+        else:
+            session = self.sessions.get(session_id)
+        if session is None or session.address != addr or session.entry.path != filename:
+            if command == "CLOSE":
+                # The session already ended and the CLOSE_OK was lost
+                protocol.send([f"FILE {filename} CLOSE_OK".encode('utf-8')], addr)
+            return
+        session.last_seen = time.monotonic()
+
+        if command == "CLOSE":
+            session.protocol.send([f"FILE {filename} CLOSE_OK".encode('utf-8')], addr)
+            self.end_session(session)
+            log.info("[SERVER] Closed connection for %s", filename)
+            return
+
+        parts = self.block_reply(session, start, end)
+        if parts is None:
+            self.metrics.count('invalid_requests')
+            log.warning("[ERROR] Invalid block request: %s", request)
+            return
+        session.protocol.send(parts, addr)
+        self.count_block(session, parts, started)
+        log.debug("[SERVER] Sent block %s-%s to %s", start, end, addr)
 
     def run(self):
         try:
-            while self.running:
-                # Receive initial DOWNLOAD request on welcome socket (Lecture 7: UDP Protocol)
-                data, addr = self.welcome_socket.recvfrom(1024)
-                request = data.decode('utf-8').strip()
-                print(f"[SERVER] New request from {addr}: {request}")
-
-                # Process DOWNLOAD request (Protocol specification)
-                if request.startswith("DOWNLOAD"):
-                    filename = request[9:].strip()
-                    if not os.path.exists(filename):
-                        # Send error response for non-existent file (Protocol specification)
-                        err_msg = f"ERR {filename} NOT_FOUND"
-                        self.welcome_socket.sendto(err_msg.encode('utf-8'), addr)
-                        print(f"[SERVER] File not found: {filename}")
-                    else:
-                        file_size = os.path.getsize(filename)
-                        # Create new thread for client (Lecture 5: Multithreading)
-                        threading.Thread(
-                            target=self.handle_client,
-                            args=(filename, file_size, addr),
-                            daemon=True
-                        ).start()
+            self.metrics.start_exports(self.options)
+            if self.mode == 'async':
+                asyncio.run(self.serve_async())
+            else:
+                self.serve_threads()
 
         except KeyboardInterrupt:
-            print("\n[SERVER] Shutting down...")
+            log.info("[SERVER] Shutting down...")
         except Exception as e:
-            print(f"[CRITICAL] Server error: {e}")
+            log.critical("[CRITICAL] Server error: %s", e)
         finally:
             self.cleanup()
 
@@ -128,12 +496,24 @@ class UDPServer:
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) != 2:
-        print("Usage: python UDPserver.py <port>")
+    if len(sys.argv) < 2:
+        print("Usage: python UDPserver.py <port> [--cache-files N] [--mode thread|async] [--sockets N] "
+              "[--session-timeout SECONDS]\n"
+              "                        [--metrics-port N] [--metrics-file PATH] [--metrics-interval SECONDS] "
+              "[--log-level DEBUG|INFO|WARNING]")
+        sys.exit(1)
+    try:
+        options = parse_options(sys.argv[2:], DEFAULT_OPTIONS)
+        setup_logging(options['log-level'])
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if options['mode'] not in ('thread', 'async'):
+        print(f"Error: Unknown mode {options['mode']}")
         sys.exit(1)
 
     try:
-        server = UDPServer(int(sys.argv[1]))
+        server = UDPServer(int(sys.argv[1]), options)
         server.run()
     except OSError:
         print("[FATAL] Failed to initialize server")
@@ -0,0 +1,195 @@
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# The benchmarks live one directory below the modules they measure
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_loopback import ROOT, TUPLE_SERVER, measure_tuple_run, start_server, tcp_ready, tuple_plans
+from common import parse_options
+from tuple_space import OPERATIONS, OperationStats, ShardedTupleSpace
+
+# Option defaults, each one can be overridden with --name value on the command line
+DEFAULT_OPTIONS = {
+    'threads': '1,2,4,8,16',  # Comma separated client thread counts to measure
+    'operations': 200000,  # Operations run by each measurement, split between the threads
+    'keys': 10000,  # Size of the key space, smaller means more contention
+    'shards': 64,
+    # Server scaling measurement
+    'workers': '1,2,4',  # Comma separated --workers counts of the tuple space server, empty to skip it
+    'connections': 16,  # Client connections to the server
+    'requests': 30000,  # P/R/G requests per server measurement, split between the connections
+    'window': 8,  # Requests in flight per connection
+    'port': 53110,
+}
+
+
+# The old design for comparison: one dict behind one lock shared by every thread
+class GlobalLockTupleSpace:
+    def __init__(self):
+        self.tuples = {}
+        self.lock = threading.Lock()
+
+    def read(self, key):
+        with self.lock:
+            return self.tuples.get(key)
+
+    def get(self, key):
+        with self.lock:
+            return self.tuples.pop(key, None)
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.tuples:
+                return False
+            self.tuples[key] = value
+            return True
+
+
+# Run an even R/G/P mix from one thread, drawing keys from the shared key space
+def worker(space, stats, operations, keys, seed, barrier):
+    rng = random.Random(seed)
+    commands = [rng.choice('RGP') for _ in range(operations)]
+    names = [f"k{rng.randrange(keys)}" for _ in range(operations)]
+    barrier.wait()
+    for command, key in zip(commands, names):
+        if command == 'R':
+            space.read(key)
+        elif command == 'G':
+            space.get(key)
+        else:
+            space.put(key, 'value')
+        stats.add(OPERATIONS)
+    stats.retire()
+
+
+# Time one run and return operations per second
+def measure(space, thread_count, options):
+    stats = OperationStats()
+    per_thread = options['operations'] // thread_count
+    barrier = threading.Barrier(thread_count + 1)
+    threads = [
+        threading.Thread(target=worker, args=(space, stats, per_thread, options['keys'], i, barrier))
+        for i in range(thread_count)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    # Check that no counter update was lost while the threads ran
+    assert stats.snapshot()['operations'] == per_thread * thread_count
+    return per_thread * thread_count / elapsed
+
+
+# Every thread takes every tuple of a filled store and puts the same fresh keys, each in its own order. With an
+# atomic G and P each tuple is taken by exactly one thread and each key is put by exactly one. Return the number
+# of tuples taken more than once and of keys put more than once.
+def check_atomic(space, thread_count, options):
+    keys = [f"a{i}" for i in range(options['keys'])]
+    for key in keys:
+        space.put(key, 'value')
+    taken = [[] for _ in range(thread_count)]
+    placed = [[] for _ in range(thread_count)]
+    barrier = threading.Barrier(thread_count)
+
+    def race(index):
+        rng = random.Random(index)
+        order = list(range(options['keys']))
+        rng.shuffle(order)
+        barrier.wait()
+        for i in order:
+            if space.get(keys[i]) is not None:
+                taken[index].append(i)
+            if space.put(f"b{i}", 'value'):
+                placed[index].append(i)
+
+    threads = [threading.Thread(target=race, args=(i,)) for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    taken = [i for thread_taken in taken for i in thread_taken]
+    placed = [i for thread_placed in placed for i in thread_placed]
+    # Every tuple must be gone and every fresh key present, whatever the interleaving
+    assert len(set(taken)) == len(set(placed)) == options['keys']
+    return len(taken) - len(set(taken)), len(placed) - len(set(placed))
+
+
+# Stop a server started with --workers. SIGINT lets it terminate its worker processes, which would otherwise
+# keep serving the port after the parent is gone.
+def stop_workers(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# Requests per second of the tuple space server with the given number of worker processes. Each connection puts,
+# reads and takes its own keys, which may live in any worker's partition.
+def measure_workers(workers, options, directory):
+    port = options['port']
+    server = start_server(TUPLE_SERVER, [str(port), '--workers', str(workers), '--log-level', 'WARNING'], ROOT,
+                          directory, lambda: tcp_ready(port))
+    try:
+        run_options = {'operations': options['requests'], 'seed': 1, 'binary': False, 'window': options['window']}
+        plans = tuple_plans(options['connections'], 8, 16, run_options, workers)
+        rate, _ = measure_tuple_run(port, plans, run_options)
+        return rate
+    finally:
+        stop_workers(server)
+
+
+def main():
+    try:
+        options = parse_options(sys.argv[1:], DEFAULT_OPTIONS)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    thread_counts = [int(count) for count in options['threads'].split(',')]
+
+    print(f"{'threads':>8} {'global lock ops/s':>18} {'sharded ops/s':>14} {'speedup':>8}")
+    for thread_count in thread_counts:
+        baseline = measure(GlobalLockTupleSpace(), thread_count, options)
+        sharded = measure(ShardedTupleSpace(options['shards']), thread_count, options)
+        print(f"{thread_count:>8} {baseline:>18.0f} {sharded:>14.0f} {sharded / baseline:>8.2f}")
+
+    # On CPython the GIL runs one thread at a time, so shard locks do not add throughput in one process. What
+    # they keep is the atomic G and P of the global lock.
+    print()
+    print(f"{'threads':>8} {'store':>12} {'taken twice':>12} {'put twice':>10}")
+    for thread_count in thread_counts:
+        for name, space in (('global lock', GlobalLockTupleSpace()), ('sharded', ShardedTupleSpace(options['shards']))):
+            taken_twice, put_twice = check_atomic(space, thread_count, options)
+            print(f"{thread_count:>8} {name:>12} {taken_twice:>12} {put_twice:>10}")
+
+    # Throughput scales with processes instead, each worker owning the partition of the keys that hash to it
+    if options['workers']:
+        print()
+        print(f"{'workers':>8} {'requests/s':>11} {'speedup':>8}")
+        directory = tempfile.mkdtemp(prefix='bench-contention-')
+        first = None
+        try:
+            for workers in [int(count) for count in options['workers'].split(',')]:
+                rate = measure_workers(workers, options, directory)
+                first = first or rate
+                print(f"{workers:>8} {rate:>11.0f} {rate / first:>8.2f}")
+        except RuntimeError as e:
+            print(f"Error: {e}, server logs are in {directory}")
+            return
+        shutil.rmtree(directory)
+        print(f"({os.cpu_count()} CPUs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+import contextlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import selectors
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# The benchmarks live one directory below the modules they measure
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common import parse_options
+from UDPclient import DEFAULT_OPTIONS as UDP_CLIENT_OPTIONS, UDPClient
+
+TUPLE_SERVER = os.path.join(ROOT, 'COMPX234-A3(sever).py')
+UDP_SERVER = os.path.join(ROOT, 'UDPserver.py')
+
+# The client script's name is not a module name, so its load generator is loaded from the file
+_spec = importlib.util.spec_from_file_location('tuple_client', os.path.join(ROOT, 'COMPX234-A3(client).py'))
+tuple_client = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(tuple_client)
+
+# Option defaults, each one can be overridden with --name value on the command line
+DEFAULT_OPTIONS = {
+    'suites': 'tuple,udp',  # Comma separated suites to run
+    'output': '',  # Write the results as JSON to this file
+    'baseline': '',  # Compare the results with an earlier --output file and exit with 1 on a regression
+    'tolerance': 0.15,  # Fraction by which a result may be worse than the baseline before it is a regression
+    'repeat': 3,  # Runs of every measurement, the median is reported
+    'seed': 1,  # Seed of the generated values and of the proxy's losses, so every run sees the same sequence
+    # Tuple space suite
+    'server-modes': 'thread,async',  # Comma separated --mode values of the tuple space server
+    'connections': '1,4,16',  # Comma separated client connection counts
+    'sizes': '8:16,16:256,32:900',  # Comma separated key:value sizes in characters
+    'operations': 30000,  # P/R/G requests per measurement, split between the connections
+    'window': 1,  # Requests in flight per connection
+    'binary': False,  # Use the binary protocol, needed for sizes over the 999 byte text message limit
+    'tuple-port': 53100,
+    # UDP suite
+    'udp-modes': 'async,thread',  # Comma separated --mode values of the UDP server
+    'file-sizes': '100000,1000000,10000000',  # Comma separated sizes of the downloaded files in bytes
+    'loss': '0,0.01,0.05',  # Comma separated fractions of datagrams the proxy drops in each direction
+    'udp-window': UDP_CLIENT_OPTIONS['window'],
+    'udp-port': 53101,
+}
+
+
+# Start a server script in its own process and return it once connect() says it is listening. The servers
+# print their periodic summaries and logs to files in directory rather than into the results.
+def start_server(script, args, cwd, directory, ready):
+    log = open(os.path.join(directory, os.path.basename(script) + '.log'), 'a')
+    process = subprocess.Popen([sys.executable, script] + args, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{os.path.basename(script)} exited with {process.returncode}")
+        if ready():
+            return process
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{os.path.basename(script)} did not start")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# True once a TCP server accepts connections on port
+def tcp_ready(port):
+    try:
+        socket.create_connection(('localhost', port), timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+
+# True once a UDP file server answers a DOWNLOAD of a file that does not exist
+def udp_ready(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.settimeout(0.2)
+        try:
+            probe.sendto(b"DOWNLOAD .benchmark-probe", ('localhost', port))
+            return probe.recvfrom(65536)[0].startswith(b"ERR")
+        except OSError:
+            return False
+
+
+# Return the median of a list of numbers
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+# Build the messages of every connection. Each connection puts, reads and then takes its own keys, so every
+# request succeeds and the run leaves the tuple space empty for the next one.
+def tuple_plans(connections, key_size, value_size, options, run):
+    per_connection = max(1, options['operations'] // (3 * connections))
+    rng = random.Random(options['seed'])
+    value = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(value_size))
+    plans = []
+    for connection in range(connections):
+        keys = [f"k{run}.{connection}.{i}.".ljust(key_size, 'x') for i in range(per_connection)]
+        requests = ([(None, 'P', key, value) for key in keys] + [(None, 'R', key, '') for key in keys] +
+                    [(None, 'G', key, '') for key in keys])
+        plans.append(tuple_client.build_messages(requests, options['binary']))
+    return plans
+
+
+# Time one run of every connection at once and return (requests per second, (command, latency) pairs)
+def measure_tuple_run(port, plans, options):
+    results = []
+    failures = []
+
+    def connection(plan):
+        try:
+            tuple_client.run_load_connection('localhost', port, plan, max(1, options['window']), 0.0,
+                                             options['binary'], results)
+        except Exception as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=connection, args=(plan,)) for plan in plans]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(plans)} connections failed: {failures[0]}")
+    requests = sum(len(plan) for plan in plans)
+    if len(results) != requests:
+        raise RuntimeError(f"{requests - len(results)} requests got no response")
+    return requests / elapsed, results
+
+
+# R/G/P throughput and latency of the tuple space server for every mode, connection count and size
+def run_tuple_suite(options, directory):
+    sizes = [tuple(int(size) for size in pair.split(':')) for pair in options['sizes'].split(',')]
+    port = options['tuple-port']
+    results = []
+    run = 0
+    for mode in options['server-modes'].split(','):
+        server = start_server(TUPLE_SERVER, [str(port), '--mode', mode, '--log-level', 'WARNING'], ROOT, directory,
+                              lambda: tcp_ready(port))
+        try:
+            for connections in [int(count) for count in options['connections'].split(',')]:
+                for key_size, value_size in sizes:
+                    rates = []
+                    latencies = []
+                    for _ in range(options['repeat']):
+                        run += 1
+                        rate, latency = measure_tuple_run(port, tuple_plans(connections, key_size, value_size,
+                                                                            options, run), options)
+                        rates.append(rate)
+                        latencies.extend(latency)
+                    result = {
+                        'name': f"tuple {mode} connections={connections} key={key_size} value={value_size}",
+                        'ops_per_sec': median(rates),
+                    }
+                    for command in 'PRG':
+                        times = sorted(seconds * 1000 for name, seconds in latencies if name == command)
+                        result[f"{command}_p50_ms"] = tuple_client.percentile(times, 0.5)
+                        result[f"{command}_p99_ms"] = tuple_client.percentile(times, 0.99)
+                    print(f"{result['name']}: {result['ops_per_sec']:.0f} ops/s, "
+                          f"P/R/G p99 {result['P_p99_ms']:.3f}/{result['R_p99_ms']:.3f}/{result['G_p99_ms']:.3f} ms")
+                    results.append(result)
+        finally:
+            stop_server(server)
+    return results
+
+
+# Relay datagrams between clients and a UDP file server on this host, dropping each one with the given
+# probability. Every client gets its own socket towards the server, so replies find their way back. The PORT of
+# an OK reply is rewritten to the proxy's, and FILE requests are sent on to the last data port the client's
+# session was given, so downloads work whether the server uses its own port or one per session.
+def run_proxy(server_port, loss, seed, ready):
+    rng = random.Random(seed)
+    front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    front.bind(('127.0.0.1', 0))
+    front_port = front.getsockname()[1]
+    upstream = {}  # client address -> socket towards the server
+    data_ports = {}  # client address -> data port of its last OK reply
+    selector = selectors.DefaultSelector()
+    selector.register(front, selectors.EVENT_READ)
+    ready.send(front_port)
+    while True:
+        for key, _ in selector.select():
+            data, address = key.fileobj.recvfrom(65536)
+            if rng.random() < loss:
+                continue
+            if key.fileobj is front:
+                sock = upstream.get(address)
+                if sock is None:
+                    sock = upstream[address] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+                    selector.register(sock, selectors.EVENT_READ, address)
+                port = data_ports.get(address, server_port) if data.startswith(b"FILE ") else server_port
+                sock.sendto(data, ('127.0.0.1', port))
+            else:
+                if data.startswith(b"OK "):
+                    parts = data.split(b" ")
+                    if len(parts) > 5 and parts[4] == b"PORT":
+                        data_ports[key.data] = int(parts[5])
+                        parts[5] = str(front_port).encode()
+                        data = b" ".join(parts)
+                front.sendto(data, key.data)
+
+
+# Start the proxy in a process of its own, so that it does not share the GIL with the client, and return
+# (process, port)
+def start_proxy(server_port, loss, seed):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=run_proxy, args=(server_port, loss, seed, sender), daemon=True)
+    process.start()
+    return process, receiver.recv()
+
+
+# Download one file through the proxy with a fresh client into the working directory and return its
+# TransferStats, or None if it failed. A download that reports success but differs from original is an error.
+def download(proxy_port, filename, original, options):
+    client_options = dict(UDP_CLIENT_OPTIONS, window=options['udp-window'], fresh=True)
+    client = UDPClient('localhost', proxy_port, None, client_options)
+    try:
+        with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+            done = client.download_file(filename)
+    finally:
+        client.socket.close()
+    if not done:
+        return None
+    with open(filename, 'rb') as copy, open(original, 'rb') as source:
+        if copy.read() != source.read():
+            raise RuntimeError(f"{filename} was not downloaded correctly")
+    return client.transfer_stats[filename]
+
+
+# Download throughput against file size for every UDP server mode and loss rate
+def run_udp_suite(options, directory):
+    served = os.path.join(directory, 'served')
+    received = os.path.join(directory, 'received')
+    os.makedirs(served)
+    os.makedirs(received)
+    rng = random.Random(options['seed'])
+    file_sizes = [int(size) for size in options['file-sizes'].split(',')]
+    for size in file_sizes:
+        with open(os.path.join(served, f"file{size}.bin"), 'wb') as file:
+            file.write(rng.randbytes(size))
+
+    port = options['udp-port']
+    results = []
+    cwd = os.getcwd()
+    os.chdir(received)  # The client writes every download to its working directory
+    try:
+        for mode in options['udp-modes'].split(','):
+            server = start_server(UDP_SERVER, [str(port), '--mode', mode, '--log-level', 'WARNING'], served,
+                                  directory, lambda: udp_ready(port))
+            try:
+                for loss in [float(fraction) for fraction in options['loss'].split(',')]:
+                    proxy, proxy_port = start_proxy(port, loss, options['seed'])
+                    try:
+                        for size in file_sizes:
+                            filename = f"file{size}.bin"
+                            runs = [download(proxy_port, filename, os.path.join(served, filename), options)
+                                    for _ in range(options['repeat'])]
+                            finished = [stats for stats in runs if stats is not None]
+                            result = {
+                                'name': f"udp {mode} loss={loss:g} size={size}",
+                                'failures': len(runs) - len(finished),
+                            }
+                            if finished:
+                                result['mb_per_sec'] = median([size / stats.elapsed / 1e6 for stats in finished])
+                                result['seconds'] = median([stats.elapsed for stats in finished])
+                                result['retransmits'] = median([stats.retransmits for stats in finished])
+                                print(f"{result['name']}: {result['mb_per_sec']:.2f} MB/s in {result['seconds']:.3f}s, "
+                                      f"{result['retransmits']} retransmits, {result['failures']} failures")
+                            else:
+                                print(f"{result['name']}: every download failed")
+                            results.append(result)
+                    finally:
+                        proxy.terminate()
+                        proxy.join()
+            finally:
+                stop_server(server)
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+# Print how every result changed against the baseline and return the number of regressions. Throughput,
+# which is better higher, and p99 latency, better lower, are regressions when they get worse by more than the
+# tolerance; a throughput missing because every download failed and any rise in failures always are. Median
+# latencies of a few microseconds move too much between runs, so they and the other figures are only reported.
+def compare(results, baseline, tolerance):
+    previous = {result['name']: result for result in baseline['results']}
+    regressions = 0
+    print(f"\nChange against the baseline of {time.ctime(baseline['time'])} (tolerance {tolerance:.0%}):")
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None:
+            print(f"{result['name']}: not in the baseline")
+            continue
+        changes = []
+        metrics = [metric for metric in old if metric != 'name'] + [metric for metric in result if metric not in old]
+        for metric in metrics:
+            higher_is_better = metric in ('ops_per_sec', 'mb_per_sec')
+            value = result.get(metric)
+            if value is None:
+                regression = higher_is_better
+                change = "missing"
+            elif not old.get(metric):
+                regression = metric == 'failures' and value > 0
+                change = f"{old.get(metric)} -> {value}"
+            else:
+                ratio = value / old[metric] - 1
+                worse = -ratio if higher_is_better else ratio
+                if metric == 'failures':
+                    regression = ratio > 0
+                else:
+                    regression = (higher_is_better or metric.endswith('_p99_ms')) and worse > tolerance
+                change = f"{ratio:+.1%}"
+            regressions += regression
+            changes.append(f"{metric} {change}{' REGRESSION' if regression else ''}")
+        print(f"{result['name']}: " + ", ".join(changes))
+    print(f"{regressions} regressions")
+    return regressions
+
+
+def main():
+    try:
+        options = parse_options(sys.argv[1:], DEFAULT_OPTIONS)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    suites = options['suites'].split(',')
+    unknown = set(suites) - {'tuple', 'udp'}
+    if unknown:
+        print(f"Error: Unknown suite {', '.join(sorted(unknown))}")
+        return 1
+    if not options['binary'] and any(sum(int(size) for size in pair.split(':')) > 970
+                                     for pair in options['sizes'].split(',')):
+        print("Error: Key and value sizes over 970 characters in total need --binary")
+        return 1
+
+    directory = tempfile.mkdtemp(prefix='bench-loopback-')
+    results = []
+    try:
+        if 'tuple' in suites:
+            results += run_tuple_suite(options, directory)
+        if 'udp' in suites:
+            results += run_udp_suite(options, directory)
+    except RuntimeError as e:
+        print(f"Error: {e}, server logs are in {directory}")
+        return 1
+    shutil.rmtree(directory)
+
+    report = {
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'options': options,
+        'results': results,
+    }
+    if options['output']:
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    if options['baseline']:
+        with open(options['baseline'], 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if compare(results, baseline, options['tolerance']):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# The benchmarks live one directory below the modules they measure
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import parse_options
+from tuple_space import CompactTupleStore, ShardedTupleSpace
+
+# Option defaults, each one can be overridden with --name value on the command line
+DEFAULT_OPTIONS = {
+    'tuples': 1000000,  # Number of tuples stored
+    'value-size': 16,  # Length of every value
+    'shards': 64,
+}
+
+
+# Fill a tuple space with distinct keys and values
+def fill(store_factory, options):
+    space = ShardedTupleSpace(options['shards'], store_factory)
+    for i in range(options['tuples']):
+        space.put(f"key{i}", f"{i:0{options['value-size']}d}")
+    return space
+
+
+# Return (bytes allocated per tuple, puts per second, reads per second) for one storage backend.
+# Memory is traced in its own pass because tracemalloc slows every allocation down.
+def measure(store_factory, options):
+    gc.collect()
+    tracemalloc.start()
+    space = fill(store_factory, options)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del space
+    gc.collect()
+
+    start = time.perf_counter()
+    space = fill(store_factory, options)
+    put_rate = options['tuples'] / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(options['tuples']):
+        space.read(f"key{i}")
+    read_rate = options['tuples'] / (time.perf_counter() - start)
+    return allocated / options['tuples'], put_rate, read_rate
+
+
+def main():
+    try:
+        options = parse_options(sys.argv[1:], DEFAULT_OPTIONS)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    # Raw UTF-8 data per tuple, for comparison with what each store allocates
+    data = sum(len(f"key{i}") for i in range(options['tuples'])) / options['tuples'] + options['value-size']
+    print(f"{options['tuples']} tuples, {data:.1f} bytes of key and value data per tuple")
+    print(f"{'storage':>8} {'bytes/tuple':>12} {'puts/s':>10} {'reads/s':>10}")
+    for name, store_factory in (('dict', dict), ('compact', CompactTupleStore)):
+        per_tuple, put_rate, read_rate = measure(store_factory, options)
+        print(f"{name:>8} {per_tuple:>12.1f} {put_rate:>10.0f} {read_rate:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
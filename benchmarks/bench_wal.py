@@ -0,0 +1,108 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# The benchmarks live one directory below the modules they measure
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import parse_options
+from tuple_space import ShardedTupleSpace
+from tuple_wal import WriteAheadLog
+
+# Option defaults, each one can be overridden with --name value on the command line
+DEFAULT_OPTIONS = {
+    'threads': '1,4,16,64',  # Comma separated writer thread counts to measure
+    'puts': 20000,  # Puts run by each throughput measurement, split between the threads
+    'recovery-tuples': 10000000,  # Tuples in the store whose recovery is timed
+    'tail': 100000,  # Log records written after the snapshot, replayed on top of it
+    'directory': '',  # Where to put the log, a temporary directory by default
+}
+
+
+# Each writer puts its keys one at a time and waits for durability before the next, like a client without pipelining
+def writer(space, wal, first, count, barrier):
+    barrier.wait()
+    for i in range(first, first + count):
+        space.put(f"key{i}", f"value{i}")
+        if wal:
+            wal.sync().result()
+
+
+# Return puts per second for one thread count, with or without the write-ahead log
+def measure_puts(thread_count, options, durable):
+    directory = tempfile.mkdtemp(dir=options['directory'] or None)
+    try:
+        space = ShardedTupleSpace()
+        wal = None
+        if durable:
+            wal = WriteAheadLog(directory, space)
+            wal.recover()
+            wal.start()
+        per_thread = options['puts'] // thread_count
+        barrier = threading.Barrier(thread_count + 1)
+        threads = [
+            threading.Thread(target=writer, args=(space, wal, i * per_thread, per_thread, barrier))
+            for i in range(thread_count)
+        ]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if wal:
+            wal.close()
+        return per_thread * thread_count / elapsed
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# Build a snapshot of the given size plus a log tail, then time how long a fresh store takes to recover it
+def measure_recovery(options):
+    directory = tempfile.mkdtemp(dir=options['directory'] or None)
+    try:
+        space = ShardedTupleSpace()
+        for i in range(options['recovery-tuples']):
+            space.restore(f"key{i}", f"value{i}")
+        wal = WriteAheadLog(directory, space, snapshot_every=options['recovery-tuples'] + options['tail'] + 1)
+        wal.recover()
+        wal.write_snapshot(wal.segment)
+        wal.start()
+        for i in range(options['tail']):
+            space.get(f"key{i}")
+        wal.sync().result()
+        wal.close()
+        del space
+
+        recovered = ShardedTupleSpace()
+        start = time.perf_counter()
+        records = WriteAheadLog(directory, recovered).recover()
+        elapsed = time.perf_counter() - start
+        return len(recovered), records, elapsed
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    try:
+        options = parse_options(sys.argv[1:], DEFAULT_OPTIONS)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    print(f"{'threads':>8} {'memory only puts/s':>19} {'durable puts/s':>15} {'ratio':>6}")
+    for thread_count in [int(count) for count in options['threads'].split(',')]:
+        memory = measure_puts(thread_count, options, False)
+        durable = measure_puts(thread_count, options, True)
+        print(f"{thread_count:>8} {memory:>19.0f} {durable:>15.0f} {durable / memory:>6.3f}")
+
+    tuples, records, elapsed = measure_recovery(options)
+    print(f"Recovered {tuples} tuples from {records} records in {elapsed:.2f}s ({records / elapsed:.0f} records/s)")
+
+
+if __name__ == "__main__":
+    main()
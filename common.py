@@ -0,0 +1,50 @@
+# Helpers shared by the tuple space and the UDP file transfer programs: command line options and power of two
+# histograms.
+
+# Histograms count values in power of two buckets: bucket i holds values from 2 ** (i - 1) to 2 ** i - 1
+HISTOGRAM_BUCKETS = 32
+
+
+# Parse the optional --name value arguments of a command line into a copy of defaults
+def parse_options(args, defaults):
+    options = dict(defaults)
+    i = 0
+    while i < len(args):
+        name = args[i][2:] if args[i].startswith('--') else ''
+        if name not in options:
+            raise ValueError(f"Unknown option {args[i]}")
+        if isinstance(defaults[name], bool):
+            # Boolean options are plain flags and do not take a value
+            options[name] = True
+            i += 1
+            continue
+        if i + 1 >= len(args):
+            raise ValueError(f"Missing value for option {args[i]}")
+        options[name] = type(defaults[name])(args[i + 1])
+        i += 2
+    return options
+
+
+# Return the histogram bucket of a non-negative integer value
+def histogram_bucket(value):
+    return min(value.bit_length(), HISTOGRAM_BUCKETS - 1)
+
+
+# Return the (smallest, largest) value counted in a histogram bucket
+def bucket_range(bucket):
+    if bucket == 0:
+        return 0, 0
+    return 2 ** (bucket - 1), 2 ** bucket - 1
+
+
+# Return the upper bound of the bucket below which the given fraction of the counted values falls
+def histogram_percentile(histogram, fraction):
+    total = sum(histogram)
+    if total == 0:
+        return 0
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if seen >= fraction * total:
+            return bucket_range(bucket)[1]
+    return bucket_range(len(histogram) - 1)[1]
@@ -0,0 +1,158 @@
+# Low overhead metrics shared by the tuple space server and the UDP file server.
+#
+# Counters and latency histograms are kept per thread, like OperationStats, so recording one is a dict lookup and
+# an add without any lock, and snapshot() adds up every thread. Gauges such as active sessions change once per
+# session rather than once per request and are simply kept under a lock. A snapshot can be pulled as JSON from a
+# small HTTP server on localhost or written to a file every few seconds.
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import HISTOGRAM_BUCKETS, histogram_bucket, histogram_percentile
+
+# Options both servers take for metrics and logging, merged into their own defaults
+METRICS_OPTIONS = {
+    'metrics-port': 0,  # Serve the metrics as JSON on http://127.0.0.1:PORT/metrics, 0 for off
+    'metrics-file': '',  # Write the metrics as JSON to this file every metrics-interval seconds, empty for off
+    'metrics-interval': 10.0,  # Seconds between writes of metrics-file
+    'log-level': 'INFO',  # DEBUG logs every request and block, INFO sessions and errors, WARNING only problems
+}
+
+
+# Send log records to stderr as plain messages at the chosen level, e.g. INFO
+def setup_logging(level):
+    numeric = logging.getLevelName(level.upper())
+    if not isinstance(numeric, int):
+        raise ValueError(f"Unknown log level {level}")
+    logging.basicConfig(level=numeric, format='%(message)s')
+
+
+class Metrics:
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.live = []  # (counters, histograms) of threads that are still recording
+        self.retired = ({}, {})  # Totals of threads that have finished
+        self.gauges = {}
+        self.started = time.time()
+
+    def _tables(self):
+        try:
+            return self.local.tables
+        except AttributeError:
+            tables = self.local.tables = ({}, {})
+            with self.lock:
+                self.live.append(tables)
+            return tables
+
+    def count(self, name, amount=1):
+        counters = self._tables()[0]
+        counters[name] = counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        # Add one latency to the histogram of name, in power of two buckets of microseconds
+        histograms = self._tables()[1]
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = [0] * HISTOGRAM_BUCKETS
+        histogram[histogram_bucket(int(seconds * 1000000))] += 1
+
+    def add_gauge(self, name, amount):
+        with self.lock:
+            self.gauges[name] = self.gauges.get(name, 0) + amount
+
+    def retire(self):
+        # Fold the calling thread's figures into the retired totals, called when a connection thread finishes
+        tables = getattr(self.local, 'tables', None)
+        if tables is None:
+            return
+        with self.lock:
+            self.live.remove(tables)
+            self._fold(tables, self.retired)
+        del self.local.tables
+
+    @staticmethod
+    def _fold(tables, totals):
+        counters, histograms = tables
+        for name, count in list(counters.items()):
+            totals[0][name] = totals[0].get(name, 0) + count
+        for name, histogram in list(histograms.items()):
+            total = totals[1].setdefault(name, [0] * HISTOGRAM_BUCKETS)
+            for bucket, count in enumerate(histogram):
+                total[bucket] += count
+
+    def snapshot(self):
+        # Return every figure as a dict that can be turned into JSON
+        totals = ({}, {})
+        with self.lock:
+            for tables in [self.retired] + self.live:
+                self._fold(tables, totals)
+            gauges = dict(self.gauges)
+        latencies = {
+            name: {
+                'count': sum(histogram),
+                'p50_us': histogram_percentile(histogram, 0.5),
+                'p99_us': histogram_percentile(histogram, 0.99),
+                'p999_us': histogram_percentile(histogram, 0.999),
+                'buckets': histogram,
+            }
+            for name, histogram in sorted(totals[1].items())
+        }
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.started,
+            'counters': dict(sorted(totals[0].items())),
+            'gauges': gauges,
+            'latency': latencies,
+        }
+
+    def serve_http(self, port):
+        # Answer GET /metrics on localhost with the snapshot as JSON, from a thread of its own
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # A line per scrape would drown the server's own log
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def export_json(self, path, interval):
+        # Replace the file at path with a fresh snapshot every interval seconds, from a thread of its own
+        def export():
+            while True:
+                time.sleep(interval)
+                with open(path + '.tmp', 'w', encoding='utf-8') as file:
+                    json.dump(self.snapshot(), file)
+                os.replace(path + '.tmp', path)
+
+        threading.Thread(target=export, daemon=True).start()
+
+    def start_exports(self, options, worker=None):
+        # Start whichever exports the options ask for. Worker processes each export their own figures, worker N
+        # on metrics-port + N and to metrics-file.N.
+        port = options['metrics-port']
+        path = options['metrics-file']
+        if worker is not None:
+            port = port + worker if port else 0
+            path = f"{path}.{worker}" if path else ''
+        if port:
+            self.serve_http(port)
+            logging.getLogger(__name__).info("Metrics on http://127.0.0.1:%d/metrics", port)
+        if path:
+            self.export_json(path, options['metrics-interval'])
@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+# The tests live one directory below the modules they check
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuple_protocol import STATUS_EXISTS, STATUS_MISSING, STATUS_OK, BinaryFramer
+from tuple_protocol import decode_binary_request, decode_binary_response, encode_binary_request, encode_binary_response
+
+REQUESTS = [
+    ('R', [('key', '')]),
+    ('G', [('ключ', '')]),
+    ('P', [('key', 'value')]),
+    ('P', [('k', 'v' * 300)]),  # Lengths over 127 take a two byte varint
+    ('R', [('a', ''), ('b', ''), ('c', '')]),
+    ('G', [('a', ''), ('b', '')]),
+    ('P', [('a', '1'), ('b', ''), ('c', 'x' * 1000)]),
+]
+
+RESULTS = [
+    [(STATUS_OK, 'value')],
+    [(STATUS_MISSING, None)],
+    [(STATUS_OK, ''), (STATUS_EXISTS, None), (STATUS_OK, 'y' * 200)],
+]
+
+
+# Strip the varint length that encode_* puts in front of the payload
+def payload(frame):
+    framer = BinaryFramer()
+    framer.feed(frame)
+    payloads = list(framer.messages())
+    assert len(payloads) == 1
+    return payloads[0]
+
+
+@pytest.mark.parametrize('command, items', REQUESTS)
+def test_request_round_trip(command, items):
+    decoded = decode_binary_request(payload(encode_binary_request(command, items)))
+    assert decoded == [(command, key, value if command == 'P' else '') for key, value in items]
+
+
+@pytest.mark.parametrize('results', RESULTS)
+def test_response_round_trip(results):
+    assert decode_binary_response(payload(encode_binary_response(results))) == results
+
+
+@pytest.mark.parametrize('command, items', REQUESTS)
+def test_truncated_request(command, items):
+    data = payload(encode_binary_request(command, items))
+    for size in range(len(data)):
+        with pytest.raises(ValueError):
+            decode_binary_request(data[:size])
+
+
+@pytest.mark.parametrize('results', RESULTS)
+def test_truncated_response(results):
+    data = payload(encode_binary_response(results))
+    for size in range(len(data)):
+        with pytest.raises(ValueError):
+            decode_binary_response(data[:size])
+
+
+def test_trailing_bytes():
+    with pytest.raises(ValueError):
+        decode_binary_request(b'\x01\x01a' + b'junk')
+    with pytest.raises(ValueError):
+        decode_binary_response(payload(encode_binary_response(RESULTS[0])) + b'\x00')
+
+
+def test_unknown_opcode():
+    with pytest.raises(ValueError):
+        decode_binary_request(b'\x09\x01a')
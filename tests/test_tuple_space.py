@@ -0,0 +1,64 @@
+import os
+import random
+import sys
+import threading
+
+# The tests live one directory below the modules they check
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tuple_space import CompactTupleStore, ShardedTupleSpace
+
+
+# Apply the same random puts, replacements and removals to the compact store and a dict, through growth,
+# tombstones and arena compaction, and check that they always agree
+def test_compact_store_matches_dict():
+    rng = random.Random(7)
+    store = CompactTupleStore()
+    model = {}
+    for step in range(20000):
+        key = f"k{rng.randrange(2000)}" + ('é' if step % 7 == 0 else '')
+        action = rng.random()
+        if action < 0.5:
+            value = 'v' * rng.randrange(40)
+            store[key] = value
+            model[key] = value
+        elif action < 0.8:
+            assert store.pop(key, None) == model.pop(key, None)
+        else:
+            assert store.get(key) == model.get(key)
+            assert (key in store) == (key in model)
+        assert len(store) == len(model)
+    assert dict(store.items()) == model
+
+
+def test_compact_store_empty_values():
+    store = CompactTupleStore()
+    store['a'] = ''
+    assert 'a' in store
+    assert store.get('a') == ''
+    assert store.pop('a') == ''
+    assert store.pop('a', None) is None
+
+
+
+
+# Many threads take the same keys at once: each tuple must be removed exactly once
+def test_concurrent_get_removes_once():
+    for store_factory in (dict, CompactTupleStore):
+        space = ShardedTupleSpace(8, store_factory)
+        for i in range(5000):
+            assert space.put(f"key{i}", f"value{i}")
+        taken = [[] for _ in range(8)]
+
+        def take(index):
+            for i in range(5000):
+                if space.get(f"key{i}") is not None:
+                    taken[index].append(i)
+
+        threads = [threading.Thread(target=take, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(i for keys in taken for i in keys) == list(range(5000))
+        assert len(space) == 0
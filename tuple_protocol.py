@@ -0,0 +1,279 @@
+# Message helpers shared by the tuple space client and server.
+#
+# Text protocol: every message starts with a 3 digit size NNN that counts the whole message, header included,
+# e.g. "011P key val" for a request and "023 OK (key, val) added" for its response.
+#
+# Binary protocol: a client asks for it by sending HELLO as the first bytes of the connection, which can never
+# start a text message, and the server answers with HELLO before its first response. After that every frame
+# is a varint payload length followed by the payload, so there is no 999 byte limit.
+#   Request payload:  opcode, then for R/G/P one item, for MREAD/MGET/MPUT a varint item count and the items.
+#                     An item is a varint key length and the key, and for puts a varint value length and the value.
+#   Response payload: a varint result count, then per result a status byte and, for OK, a varint value length
+#                     and the value.
+
+HEADER_SIZE = 3
+MAX_MESSAGE_SIZE = 999
+
+HELLO = b'\x00TSB1'
+MAX_FRAME_SIZE = 64 * 1024 * 1024  # Larger binary frames are treated as a broken stream
+
+# Binary opcodes and the text command each one carries out
+OP_READ = 1
+OP_GET = 2
+OP_PUT = 3
+OP_MREAD = 4
+OP_MGET = 5
+OP_MPUT = 6
+OPCODE_COMMANDS = {OP_READ: 'R', OP_GET: 'G', OP_PUT: 'P', OP_MREAD: 'R', OP_MGET: 'G', OP_MPUT: 'P'}
+SINGLE_OPCODES = {'R': OP_READ, 'G': OP_GET, 'P': OP_PUT}
+BATCH_OPCODES = {'R': OP_MREAD, 'G': OP_MGET, 'P': OP_MPUT}
+
+# Result of one operation
+STATUS_OK = 0
+STATUS_MISSING = 1  # R or G of a key that does not exist
+STATUS_EXISTS = 2  # P of a key that already exists
+STATUS_INVALID = 3  # Unknown command
+
+
+# Put the NNN size header in front of an encoded message body
+def frame(body):
+    size = len(body) + HEADER_SIZE
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError(f"Message size {size} exceeds {MAX_MESSAGE_SIZE}")
+    return b'%03d' % size + body
+
+
+# Build a request message such as "011P key val" or "007R key"
+def encode_request(command, key, value=''):
+    body = f"{command} {key} {value}" if command == 'P' else f"{command} {key}"
+    return frame(body.encode('utf-8'))
+
+
+# Build a response message such as "023 OK (key, val) added"
+def encode_response(text):
+    return frame(f" {text}".encode('utf-8'))
+
+
+# Return the text a response carries for one result, e.g. "OK (key, val) read" or "ERR key does not exist"
+def format_response(command, key, status, value):
+    if status == STATUS_OK:
+        action = {'R': 'read', 'G': 'removed', 'P': 'added'}[command]
+        return f"OK ({key}, {value}) {action}"
+    if status == STATUS_MISSING:
+        return f"ERR {key} does not exist"
+    if status == STATUS_EXISTS:
+        return f"ERR {key} already exists"
+    return f"ERR invalid command {command}"
+
+
+# Append the LEB128 varint encoding of a non-negative integer to a bytearray
+def put_varint(out, number):
+    while number >= 0x80:
+        out.append((number & 0x7f) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+# Decode a varint at offset, returning (number, next offset), or (None, offset) if the data ends inside it
+def get_varint(data, offset):
+    number = 0
+    shift = 0
+    while offset < len(data):
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+    return None, offset
+
+
+# Decode a varint at offset like get_varint, raising ValueError if the frame ends inside it
+def require_varint(data, offset):
+    number, offset = get_varint(data, offset)
+    if number is None:
+        raise ValueError("Truncated frame")
+    return number, offset
+
+
+# Put the varint length in front of a binary payload
+def binary_frame(payload):
+    out = bytearray()
+    put_varint(out, len(payload))
+    return bytes(out) + payload
+
+
+# Build a binary request. One item uses the single R/G/P opcode, several use MREAD/MGET/MPUT.
+# items is a list of (key, value) pairs, the value is ignored unless command is P.
+def encode_binary_request(command, items):
+    out = bytearray()
+    if len(items) == 1:
+        out.append(SINGLE_OPCODES[command])
+    else:
+        out.append(BATCH_OPCODES[command])
+        put_varint(out, len(items))
+    for key, value in items:
+        key_bytes = key.encode('utf-8')
+        put_varint(out, len(key_bytes))
+        out += key_bytes
+        if command == 'P':
+            value_bytes = value.encode('utf-8')
+            put_varint(out, len(value_bytes))
+            out += value_bytes
+    return binary_frame(bytes(out))
+
+
+# Decode a binary request payload into a list of (command, key, value) tuples
+def decode_binary_request(payload):
+    if not payload:
+        raise ValueError("Empty request")
+    opcode = payload[0]
+    command = OPCODE_COMMANDS.get(opcode)
+    if command is None:
+        raise ValueError(f"Unknown opcode {opcode}")
+    offset = 1
+    count = 1
+    if opcode not in (OP_READ, OP_GET, OP_PUT):
+        count, offset = require_varint(payload, offset)
+    requests = []
+    for _ in range(count):
+        size, offset = require_varint(payload, offset)
+        key = payload[offset:offset + size].decode('utf-8')
+        offset += size
+        value = ''
+        if command == 'P':
+            size, offset = require_varint(payload, offset)
+            value = payload[offset:offset + size].decode('utf-8')
+            offset += size
+        if offset > len(payload):
+            raise ValueError("Truncated request")
+        requests.append((command, key, value))
+    if offset != len(payload):
+        raise ValueError("Request has bytes after its last item")
+    return requests
+
+
+# Build a binary response from a list of (status, value) results
+def encode_binary_response(results):
+    out = bytearray()
+    put_varint(out, len(results))
+    for status, value in results:
+        out.append(status)
+        if status == STATUS_OK:
+            value_bytes = value.encode('utf-8')
+            put_varint(out, len(value_bytes))
+            out += value_bytes
+    return binary_frame(bytes(out))
+
+
+# Decode a binary response payload into a list of (status, value) results, value is None unless the status is OK
+def decode_binary_response(payload):
+    count, offset = require_varint(payload, 0)
+    results = []
+    for _ in range(count):
+        if offset >= len(payload):
+            raise ValueError("Truncated response")
+        status = payload[offset]
+        offset += 1
+        value = None
+        if status == STATUS_OK:
+            size, offset = require_varint(payload, offset)
+            value = payload[offset:offset + size].decode('utf-8')
+            offset += size
+            if offset > len(payload):
+                raise ValueError("Truncated response")
+        results.append((status, value))
+    if offset != len(payload):
+        raise ValueError("Response has bytes after its last result")
+    return results
+
+
+# Splits a TCP byte stream into whole messages, however the reads were coalesced or fragmented
+class MessageFramer:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.start = 0  # Offset of the first byte that has not been returned yet
+
+    def feed(self, data):
+        # Drop the consumed prefix only once it is most of the buffer, so each byte is moved at most once or twice
+        if self.start and self.start >= len(self.buffer) // 2:
+            del self.buffer[:self.start]
+            self.start = 0
+        self.buffer += data
+
+    def messages(self):
+        # Yield every complete message currently buffered, leaving a partial one for the next feed()
+        while len(self.buffer) - self.start >= HEADER_SIZE:
+            header = bytes(self.buffer[self.start:self.start + HEADER_SIZE])
+            if not header.isdigit() or int(header) <= HEADER_SIZE:
+                raise ValueError(f"Invalid message header {header!r}")
+            end = self.start + int(header)
+            if end > len(self.buffer):
+                break
+            message = bytes(self.buffer[self.start:end])
+            self.start = end
+            yield message
+
+
+# Splits a binary protocol stream into frame payloads. With hello=True the stream must start with HELLO,
+# which is checked and dropped before the first frame.
+class BinaryFramer:
+    def __init__(self, hello=False):
+        self.buffer = bytearray()
+        self.start = 0
+        self.hello = hello  # True until the HELLO at the start of the stream has been seen
+
+    def feed(self, data):
+        if self.start and self.start >= len(self.buffer) // 2:
+            del self.buffer[:self.start]
+            self.start = 0
+        self.buffer += data
+
+    def messages(self):
+        if self.hello:
+            if len(self.buffer) - self.start < len(HELLO):
+                return
+            if self.buffer[self.start:self.start + len(HELLO)] != HELLO:
+                raise ValueError("Binary stream does not start with HELLO")
+            self.start += len(HELLO)
+            self.hello = False
+        while True:
+            size, offset = get_varint(self.buffer, self.start)
+            if size is None:
+                break
+            if size > MAX_FRAME_SIZE:
+                raise ValueError(f"Frame size {size} exceeds {MAX_FRAME_SIZE}")
+            if offset + size > len(self.buffer):
+                break
+            payload = bytes(self.buffer[offset:offset + size])
+            self.start = offset + size
+            yield payload
+
+
+# Server side framer that picks the text or binary protocol from the first byte the client sends
+class ServerFramer:
+    def __init__(self):
+        self.framer = None
+        self.binary = False
+        self.greeting = b''  # HELLO to send back, taken by the first reply after the client chose binary
+
+    def feed(self, data):
+        if self.framer is None:
+            if not data:
+                return
+            self.binary = data[:1] == HELLO[:1]
+            if self.binary:
+                self.framer = BinaryFramer(hello=True)
+                self.greeting = HELLO
+            else:
+                self.framer = MessageFramer()
+        self.framer.feed(data)
+
+    def messages(self):
+        if self.framer is None:
+            return iter(())
+        return self.framer.messages()
+
+    def take_greeting(self):
+        greeting, self.greeting = self.greeting, b''
+        return greeting
@@ -0,0 +1,288 @@
+import struct
+import threading
+import zlib
+from array import array
+
+from common import HISTOGRAM_BUCKETS, histogram_bucket
+
+# Indexes of the counters kept by OperationStats
+CLIENTS = 0
+OPERATIONS = 1
+READS = 2
+GETS = 3
+PUTS = 4
+ERRORS = 5
+COUNTER_NAMES = ('clients', 'operations', 'reads', 'gets', 'puts', 'errors')
+
+
+# Tuple space split into shards by key hash, each shard guarded by its own lock.
+# A G or P only locks the shard that owns its key, so operations on different keys rarely wait for each other.
+# Every shard also keeps running key and value length totals and a power of two tuple size histogram, updated by
+# each G and P, so a summary costs the same however many tuples are stored.
+# When a write-ahead log is attached, each successful G and P is appended to it while the shard lock is held,
+# so the log records the changes to a key in the order they were applied.
+class ShardedTupleSpace:
+    def __init__(self, shard_count=64, store_factory=dict):
+        self.shard_count = shard_count
+        self.log = None  # Optional WriteAheadLog that records every change
+        self.shards = [store_factory() for _ in range(shard_count)]  # dict, or CompactTupleStore to save memory
+        self.locks = [threading.Lock() for _ in range(shard_count)]
+        self.sizes = [[0, 0] for _ in range(shard_count)]  # Total key and value length of each shard
+        self.histograms = [[0] * HISTOGRAM_BUCKETS for _ in range(shard_count)]
+
+    def _index(self, key):
+        return hash(key) % self.shard_count
+
+    def read(self, key):
+        # Return the value stored under key, or None if the key does not exist
+        index = self._index(key)
+        with self.locks[index]:
+            return self.shards[index].get(key)
+
+    def get(self, key):
+        # Remove key and return its value, or None if the key does not exist.
+        # The lookup and the removal happen under one lock, so two clients can never remove the same tuple.
+        index = self._index(key)
+        with self.locks[index]:
+            value = self.shards[index].pop(key, None)
+            if value is not None:
+                self._count(index, key, value, -1)
+                if self.log:
+                    self.log.append_get(key)
+            return value
+
+    def put(self, key, value):
+        # Add the tuple and return True, or return False if the key already exists
+        index = self._index(key)
+        with self.locks[index]:
+            shard = self.shards[index]
+            if key in shard:
+                return False
+            shard[key] = value
+            self._count(index, key, value, 1)
+            if self.log:
+                self.log.append_put(key, value)
+            return True
+
+    def restore(self, key, value):
+        # Store a tuple read back from the log or a snapshot, replacing any value the key already has
+        index = self._index(key)
+        with self.locks[index]:
+            old_value = self.shards[index].get(key)
+            if old_value is not None:
+                self._count(index, key, old_value, -1)
+            self.shards[index][key] = value
+            self._count(index, key, value, 1)
+
+    def _count(self, index, key, value, sign):
+        # Add (sign 1) or remove (sign -1) a tuple from the running totals, called with the shard lock held
+        sizes = self.sizes[index]
+        sizes[0] += sign * len(key)
+        sizes[1] += sign * len(value)
+        self.histograms[index][histogram_bucket(len(key) + len(value))] += sign
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def summary(self):
+        # Return the tuple count, total key length, total value length and the combined size histogram.
+        # Only the per shard totals are added up, so the cost does not depend on the number of tuples.
+        count = key_size = value_size = 0
+        histogram = [0] * HISTOGRAM_BUCKETS
+        for index in range(self.shard_count):
+            with self.locks[index]:
+                count += len(self.shards[index])
+                key_size += self.sizes[index][0]
+                value_size += self.sizes[index][1]
+                for bucket, tuples in enumerate(self.histograms[index]):
+                    histogram[bucket] += tuples
+        return count, key_size, value_size, histogram
+
+    def items(self):
+        # Copy the tuples one shard at a time so no lock is held for the whole walk
+        for index in range(self.shard_count):
+            with self.locks[index]:
+                shard_items = list(self.shards[index].items())
+            yield from shard_items
+
+
+# Entry header in a CompactTupleStore arena: key length and value length
+ENTRY_HEADER = struct.Struct('<II')
+EMPTY_SLOT = 0
+DELETED_SLOT = 0xffffffff
+
+
+# Dict-like store for one shard that keeps tuples as UTF-8 bytes instead of Python objects.
+# Each tuple is appended to one bytearray arena as a small header, the key bytes and the value bytes,
+# and an open addressing index maps keys to arena offsets. The index is two arrays of 32 bit integers:
+# the entry offset plus one (0 marks an empty slot, DELETED_SLOT a removed one) and the key hash, which
+# is compared before the key bytes. Per tuple this costs 8 bytes of header plus about 12 to 32 bytes of
+# index, instead of two str objects and a dict entry. Removed entries stay in the arena until they are
+# more than half of it, then the arena is rewritten without them.
+# Supports the operations ShardedTupleSpace uses: get, pop, in, item assignment, len and items.
+class CompactTupleStore:
+    def __init__(self, capacity=8):
+        self.arena = bytearray()
+        self.offsets = array('I', [EMPTY_SLOT]) * capacity
+        self.hashes = array('I', [0]) * capacity
+        self.count = 0
+        self.used_slots = 0  # Live and deleted slots, both lengthen probe sequences
+        self.garbage = 0  # Arena bytes that belong to removed entries
+
+    def _find(self, key_bytes, key_hash):
+        # Return the slot holding the key, or -1
+        mask = len(self.offsets) - 1
+        slot = key_hash & mask
+        while True:
+            offset = self.offsets[slot]
+            if offset == EMPTY_SLOT:
+                return -1
+            if offset != DELETED_SLOT and self.hashes[slot] == key_hash:
+                start = offset - 1
+                key_size, _ = ENTRY_HEADER.unpack_from(self.arena, start)
+                key_start = start + ENTRY_HEADER.size
+                if key_size == len(key_bytes) and self.arena[key_start:key_start + key_size] == key_bytes:
+                    return slot
+            slot = (slot + 1) & mask
+
+    def _entry(self, slot):
+        # Return the (key bytes, value bytes) stored for an index slot
+        start = self.offsets[slot] - 1
+        key_size, value_size = ENTRY_HEADER.unpack_from(self.arena, start)
+        key_start = start + ENTRY_HEADER.size
+        return self.arena[key_start:key_start + key_size], self.arena[key_start + key_size:key_start + key_size + value_size]
+
+    def _insert_slot(self, key_hash, offset):
+        mask = len(self.offsets) - 1
+        slot = key_hash & mask
+        while self.offsets[slot] not in (EMPTY_SLOT, DELETED_SLOT):
+            slot = (slot + 1) & mask
+        if self.offsets[slot] == EMPTY_SLOT:
+            self.used_slots += 1
+        self.offsets[slot] = offset + 1
+        self.hashes[slot] = key_hash
+
+    def _rebuild(self, capacity):
+        # Rewrite the index with the given number of slots and the arena without removed entries
+        old_offsets = self.offsets
+        old_arena = self.arena
+        self.offsets = array('I', [EMPTY_SLOT]) * capacity
+        old_hashes, self.hashes = self.hashes, array('I', [0]) * capacity
+        self.arena = bytearray()
+        self.used_slots = 0
+        self.garbage = 0
+        for slot, offset in enumerate(old_offsets):
+            if offset in (EMPTY_SLOT, DELETED_SLOT):
+                continue
+            start = offset - 1
+            key_size, value_size = ENTRY_HEADER.unpack_from(old_arena, start)
+            end = start + ENTRY_HEADER.size + key_size + value_size
+            self._insert_slot(old_hashes[slot], len(self.arena))
+            self.arena += old_arena[start:end]
+
+    @staticmethod
+    def _hash(key_bytes):
+        # Not hash(): for ASCII keys it equals the str hash that picked the shard, so every key in a shard
+        # would share its low bits and land in the same few slots
+        return zlib.crc32(key_bytes)
+
+    def get(self, key, default=None):
+        key_bytes = key.encode('utf-8')
+        slot = self._find(key_bytes, self._hash(key_bytes))
+        if slot < 0:
+            return default
+        return self._entry(slot)[1].decode('utf-8')
+
+    def __contains__(self, key):
+        key_bytes = key.encode('utf-8')
+        return self._find(key_bytes, self._hash(key_bytes)) >= 0
+
+    def pop(self, key, default=None):
+        key_bytes = key.encode('utf-8')
+        slot = self._find(key_bytes, self._hash(key_bytes))
+        if slot < 0:
+            return default
+        _, value_bytes = self._entry(slot)
+        self.offsets[slot] = DELETED_SLOT
+        self.count -= 1
+        self.garbage += ENTRY_HEADER.size + len(key_bytes) + len(value_bytes)
+        if self.garbage > len(self.arena) // 2 and self.garbage > 4096:
+            self._rebuild(len(self.offsets))
+        return value_bytes.decode('utf-8')
+
+    def __setitem__(self, key, value):
+        key_bytes = key.encode('utf-8')
+        value_bytes = value.encode('utf-8')
+        key_hash = self._hash(key_bytes)
+        slot = self._find(key_bytes, key_hash)
+        if slot >= 0:
+            # Replacing a value leaves the old entry behind as garbage
+            old_key, old_value = self._entry(slot)
+            self.offsets[slot] = DELETED_SLOT
+            self.garbage += ENTRY_HEADER.size + len(old_key) + len(old_value)
+            self.count -= 1
+        if len(self.arena) + ENTRY_HEADER.size + len(key_bytes) + len(value_bytes) >= DELETED_SLOT - 1:
+            raise MemoryError("Compact store arena is full, use more shards")
+        # Keep the index at most two thirds full, counting deleted slots
+        if (self.used_slots + 1) * 3 > len(self.offsets) * 2:
+            capacity = len(self.offsets)
+            while (self.count + 1) * 2 > capacity:
+                capacity *= 2
+            self._rebuild(capacity)
+        offset = len(self.arena)
+        self.arena += ENTRY_HEADER.pack(len(key_bytes), len(value_bytes))
+        self.arena += key_bytes
+        self.arena += value_bytes
+        self._insert_slot(key_hash, offset)
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        for slot, offset in enumerate(self.offsets):
+            if offset not in (EMPTY_SLOT, DELETED_SLOT):
+                key_bytes, value_bytes = self._entry(slot)
+                yield key_bytes.decode('utf-8'), value_bytes.decode('utf-8')
+
+
+# Operation counters kept separately by every thread and added together when read.
+# Incrementing a counter never takes a lock, and no update is lost to a racing "+= 1".
+class OperationStats:
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.live = []  # Counter lists of threads that are still counting
+        self.retired = [0] * len(COUNTER_NAMES)  # Totals of threads that have finished
+
+    def _counters(self):
+        try:
+            return self.local.counters
+        except AttributeError:
+            counters = self.local.counters = [0] * len(COUNTER_NAMES)
+            with self.lock:
+                self.live.append(counters)
+            return counters
+
+    def add(self, counter, amount=1):
+        self._counters()[counter] += amount
+
+    def retire(self):
+        # Fold the calling thread's counters into the retired totals, called when a client thread finishes
+        counters = getattr(self.local, 'counters', None)
+        if counters is None:
+            return
+        with self.lock:
+            self.live.remove(counters)
+            for i, count in enumerate(counters):
+                self.retired[i] += count
+        del self.local.counters
+
+    def snapshot(self):
+        # Return a dict of counter name to the total over all threads
+        with self.lock:
+            totals = list(self.retired)
+            for counters in self.live:
+                for i, count in enumerate(counters):
+                    totals[i] += count
+        return dict(zip(COUNTER_NAMES, totals))
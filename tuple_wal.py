@@ -0,0 +1,266 @@
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import Future
+
+# Every change is one record: crc32 of the rest, operation, key length, value length, key bytes, value bytes.
+# A record cut short by a crash fails its length or checksum test and replay stops there.
+RECORD_HEADER = struct.Struct('<IBII')
+OP_PUT = 1
+OP_GET = 2
+
+
+# Encode one log record
+def encode_record(op, key, value=''):
+    key_bytes = key.encode('utf-8')
+    value_bytes = value.encode('utf-8')
+    body = struct.pack('<BII', op, len(key_bytes), len(value_bytes)) + key_bytes + value_bytes
+    return struct.pack('<I', zlib.crc32(body)) + body
+
+
+# Yield (op, key, value) for every whole record of a log or snapshot file
+def read_records(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        checksum, op, key_size, value_size = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + key_size + value_size
+        if end > len(data) or zlib.crc32(data[offset + 4:end]) != checksum:
+            break  # Torn or corrupt tail left by a crash
+        key_start = offset + RECORD_HEADER.size
+        key = data[key_start:key_start + key_size].decode('utf-8')
+        value = data[key_start + key_size:end].decode('utf-8')
+        yield op, key, value
+        offset = end
+
+
+# Make a rename or delete inside a directory durable. Directories cannot be opened on Windows, so skip it there.
+def fsync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Append-only log of every successful P and G, with group commit and periodic snapshots.
+#
+# Writers append records to an in-memory buffer while holding their shard lock, then call sync() outside it.
+# A single flusher thread writes everything buffered so far with one write and one fsync and then completes
+# every sync() that was waiting, so many concurrent writers share each fsync.
+#
+# The log is split into numbered segments, wal-N.log. Once a segment holds snapshot_every records the
+# flusher starts segment N+1 and a compaction thread writes snapshot-(N+1).dat from the live store, one
+# shard at a time, then deletes the older segments and snapshots. A change made while the snapshot is
+# being copied may be in both the snapshot and the new segment; replay treats P as "set" and G as
+# "remove if present", so applying it twice gives the same result.
+class WriteAheadLog:
+    def __init__(self, directory, tuple_space, snapshot_every=1000000, fsync=True):
+        self.directory = directory
+        self.tuple_space = tuple_space
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.local = threading.local()
+        self.cond = threading.Condition()
+        self.buffer = []
+        self.waiters = []
+        self.appended = 0  # Sequence number of the last record appended
+        self.durable = 0  # Sequence number of the last record known to be on disk
+        self.segment_records = 0
+        self.rotate_requested = False
+        self.rotated = threading.Event()
+        self.closed = False
+        self.error = None  # OSError that stopped the flusher, every later sync() fails with it
+        self.threads = []  # Flusher and compaction thread, joined by close()
+        os.makedirs(directory, exist_ok=True)
+        self.segment = 0
+        self.file = None
+
+    def _path(self, prefix, number, suffix):
+        return os.path.join(self.directory, f"{prefix}-{number:08d}{suffix}")
+
+    def _numbers(self, prefix, suffix):
+        # Return the numbers of the existing files with the given prefix and suffix, smallest first
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix + '-') and name.endswith(suffix):
+                try:
+                    numbers.append(int(name[len(prefix) + 1:-len(suffix)]))
+                except ValueError:
+                    pass
+        return sorted(numbers)
+
+    def recover(self):
+        # Load the newest snapshot and replay the segments written after it, then start a fresh segment.
+        # Return the number of records applied.
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))  # Snapshot that a crash interrupted
+        snapshots = self._numbers('snapshot', '.dat')
+        segments = self._numbers('wal', '.log')
+        first_segment = snapshots[-1] if snapshots else 0
+        applied = 0
+        log, self.tuple_space.log = self.tuple_space.log, None  # Replayed changes must not be logged again
+        try:
+            if snapshots:
+                for op, key, value in read_records(self._path('snapshot', first_segment, '.dat')):
+                    self.tuple_space.restore(key, value)
+                    applied += 1
+            for number in segments:
+                if number < first_segment:
+                    continue
+                for op, key, value in read_records(self._path('wal', number, '.log')):
+                    if op == OP_PUT:
+                        self.tuple_space.restore(key, value)
+                    else:
+                        self.tuple_space.get(key)
+                    applied += 1
+        finally:
+            self.tuple_space.log = log
+        # Never append to a segment that may end in a torn record
+        self.segment = max(segments + snapshots + [0]) + 1
+        return applied
+
+    def start(self):
+        # Open the current segment, attach the log to the tuple space and start the background threads
+        self.file = open(self._path('wal', self.segment, '.log'), 'ab')
+        self.tuple_space.log = self
+        self.threads = [
+            threading.Thread(target=self._flush_loop, daemon=True),
+            threading.Thread(target=self._compact_loop, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _append(self, record):
+        with self.cond:
+            self.buffer.append(record)
+            self.appended += 1
+            self.segment_records += 1
+            self.local.last = self.appended
+            if self.segment_records == self.snapshot_every:
+                self.cond.notify_all()
+
+    def append_put(self, key, value):
+        self._append(encode_record(OP_PUT, key, value))
+
+    def append_get(self, key):
+        self._append(encode_record(OP_GET, key))
+
+    def sync(self):
+        # Return a Future that completes once every record appended by the calling thread is on disk, or fails
+        # with the OSError that stopped the log from being written
+        future = Future()
+        target = getattr(self.local, 'last', 0)
+        with self.cond:
+            if self.error is not None:
+                future.set_exception(self.error)
+            elif self.durable >= target:
+                future.set_result(None)
+            else:
+                self.waiters.append(future)
+                self.cond.notify_all()
+        return future
+
+    def _flush_loop(self):
+        while True:
+            waiters = []
+            try:
+                with self.cond:
+                    while not self.waiters and not self.rotate_requested and not self.closed:
+                        self.cond.wait()
+                    records, self.buffer = self.buffer, []
+                    waiters, self.waiters = self.waiters, []
+                    target = self.appended
+                    file = self.file
+                    rotate = self.rotate_requested
+                    if rotate:
+                        # Records taken above still go to the old segment, everything appended from now on to the new one
+                        self.segment += 1
+                        self.segment_records = 0
+                        self.file = open(self._path('wal', self.segment, '.log'), 'ab')
+                        self.rotate_requested = False
+                    closed = self.closed
+
+                # One write and one fsync cover every record buffered by every writer since the last flush
+                if records:
+                    file.write(b''.join(records))
+                    file.flush()
+                if self.fsync and (records or rotate):
+                    os.fsync(file.fileno())
+                if rotate:
+                    file.close()
+                    fsync_directory(self.directory)
+            except OSError as e:
+                # A full or failing disk. What reached the file is unknown, so no write is confirmed from now on:
+                # the waiters of this pass and every later sync() fail, and the handlers drop their connections.
+                with self.cond:
+                    self.error = e
+                    waiters += self.waiters
+                    self.waiters = []
+                for waiter in waiters:
+                    waiter.set_exception(e)
+                self.rotated.set()  # No rotation follows, do not leave the compaction thread waiting for one
+                return
+            with self.cond:
+                self.durable = target
+            for waiter in waiters:
+                waiter.set_result(None)
+            if rotate:
+                self.rotated.set()
+            if closed:
+                self.file.close()
+                return
+
+    def _compact_loop(self):
+        while True:
+            with self.cond:
+                while self.segment_records < self.snapshot_every and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                self.rotated.clear()
+                self.rotate_requested = True
+                self.cond.notify_all()
+            self.rotated.wait()
+            if self.error is not None:
+                return
+            self.write_snapshot(self.segment)
+
+    def write_snapshot(self, segment):
+        # Write every live tuple to snapshot-<segment>.dat, then remove the files it replaces
+        path = self._path('snapshot', segment, '.dat')
+        with open(path + '.tmp', 'wb') as file:
+            batch = []
+            for key, value in self.tuple_space.items():
+                batch.append(encode_record(OP_PUT, key, value))
+                if len(batch) >= 10000:
+                    file.write(b''.join(batch))
+                    batch = []
+            file.write(b''.join(batch))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+        fsync_directory(self.directory)
+        for number in self._numbers('wal', '.log'):
+            if number < segment:
+                os.remove(self._path('wal', number, '.log'))
+        for number in self._numbers('snapshot', '.dat'):
+            if number < segment:
+                os.remove(self._path('snapshot', number, '.dat'))
+
+    def close(self):
+        # Flush what is buffered and wait for the background threads to stop. The segment file is closed and a
+        # snapshot that was being written is finished when this returns.
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,61 @@
+# Message helpers shared by the UDP file server and client.
+#
+# Control messages are text: "DOWNLOAD name [BINARY]",
+# "OK name SIZE n PORT p [MODE BINARY] [SESSION id] [DIGEST sha256]", "ERR name NOT_FOUND", "FILE name GET START s END e [SESSION id]", "FILE name CLOSE [SESSION id]" and
+# "FILE name CLOSE_OK". A client repeats the SESSION id of the OK reply in its requests, a server that gave none
+# tells downloads apart by the client address and file name. DIGEST is the hex SHA-256 of the whole file, which
+# the client checks once it has every block.
+#
+# A block reply is "FILE name OK START s END e DATA base64" unless the client asked for BINARY and the server
+# confirmed it with MODE BINARY. Then every block reply is a data frame: the FRAME_DATA byte, the 4 byte session
+# id, the 8 byte offset, the 4 byte length and the 4 byte CRC-32 of the block, big endian, followed by the raw
+# file bytes.
+import struct
+import zlib
+
+FRAME_DATA = 0x01  # Text replies start with a letter, so the first byte tells the two kinds apart
+DATA_HEADER = struct.Struct('!BIQII')
+MAX_SESSION_ID = 0xffffffff
+
+MAX_DATAGRAM = 65507  # Largest UDP payload over IPv4
+MAX_BLOCK_SIZE = MAX_DATAGRAM - DATA_HEADER.size
+ETHERNET_BLOCK_SIZE = 1500 - 20 - 8 - DATA_HEADER.size  # Largest block whose frame fits one 1500 byte Ethernet MTU
+TEXT_BLOCK_SIZE = 1000
+MAX_TEXT_BLOCK_SIZE = (MAX_DATAGRAM - 1024) // 4 * 3  # Base64 grows a block by a third, leave room for the text
+
+
+# Build the header that goes in front of the raw bytes of a block
+def encode_data_header(session_id, start, block):
+    return DATA_HEADER.pack(FRAME_DATA, session_id, start, len(block), zlib.crc32(block))
+
+
+# Return (session id, offset, length) from the header of a data frame, or None if the datagram is not one or
+# its block does not match the CRC
+def decode_data_header(frame, size):
+    if size < DATA_HEADER.size or frame[0] != FRAME_DATA:
+        return None
+    _, session_id, start, length, crc = DATA_HEADER.unpack_from(frame)
+    if DATA_HEADER.size + length != size or zlib.crc32(memoryview(frame)[DATA_HEADER.size:size]) != crc:
+        return None
+    return session_id, start, length
+
+
+# Split "FILE name GET START s END e [SESSION id]" or "FILE name CLOSE [SESSION id]" into
+# (name, command, start, end, session id). start and end are None for CLOSE, the session id is None when the
+# request has none. Returns None for anything else and raises ValueError for a number that does not parse.
+def parse_file_request(request):
+    parts = request.split()
+    session_id = None
+    if len(parts) > 2 and parts[-2] == "SESSION":
+        session_id = int(parts[-1])
+        parts = parts[:-2]
+    if len(parts) == 3 and parts[0] == "FILE" and parts[2] == "CLOSE":
+        return parts[1], "CLOSE", None, None, session_id
+    if len(parts) == 7 and parts[0] == "FILE" and parts[2:4] == ["GET", "START"] and parts[5] == "END":
+        return parts[1], "GET", int(parts[4]), int(parts[6]), session_id
+    return None
+
+
+# Return the fields after PORT of an OK reply, e.g. {"MODE": "BINARY", "SESSION": "7"}
+def parse_reply_fields(parts):
+    return dict(zip(parts[6::2], parts[7::2]))